@@ -0,0 +1,140 @@
+'''
+Measures the memory taken by the pages dictionary_creator.py holds, comparing the current datatypes against the
+previous layout (plain classes with a __dict__ and dataclasses), which is kept
+below for reference. Run it against the database produced by the converters to see the difference on the full
+dataset:
+
+python3 memory_benchmark.py "../Dictionary Creator/database.db"
+'''
+
+from dataclasses import dataclass
+from typing import List, Dict, Optional
+
+import argparse
+import sqlite3
+import tracemalloc
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dictionary Creator"))
+
+import datatypes
+
+
+@dataclass
+class LegacyEnglishTranslation:
+    translation: str
+    qualifier: Optional[str] = None
+    alternate_form: Optional[str] = None
+    literal_meaning: Optional[str] = None
+    transliteration: Optional[str] = None
+
+
+@dataclass
+class LegacyEnglishTranslationSense:
+    meaning: str
+    translations: List[LegacyEnglishTranslation]
+
+
+class LegacyEntry:
+    def __init__(self, page_title: str, language: str, entry_type: str):
+        self.page_title: str = page_title
+        self.page_id: str = "{}_{}_{}".format(language, entry_type, page_title)
+
+
+class LegacyCantoneseEntry(LegacyEntry):
+    def __init__(self, id: int, traditional: str, simplified: str):
+        super().__init__(str(id), "yue", "dictionary")
+        self.page_title = traditional
+        self.traditional = traditional
+        self.simplified = simplified
+        self.readings: List[str] = []
+        self.definitions: List[str] = []
+
+    def add_definition(self, definition: str):
+        definition = str(definition).strip()
+        if definition != "" and definition not in self.definitions:
+            self.definitions.append(definition)
+
+    def add_reading(self, reading: str):
+        reading = reading.strip()
+        if reading != "" and reading not in self.readings:
+            self.readings.append(reading)
+
+    def is_worth_adding(self) -> bool:
+        return len(self.readings) > 0 and len(self.definitions) > 0
+
+
+class LegacyEnglishEntry(LegacyEntry):
+    def __init__(self, root_word: str):
+        super().__init__(root_word, "en", "dictionary")
+        self.translations: List[LegacyEnglishTranslationSense] = []
+        self._translation_guide: Dict[str, LegacyEnglishTranslationSense] = dict()
+
+    def add_translation(self, meaning, translation, alternate, literal, qualifier, transliteration):
+        if meaning not in self._translation_guide:
+            new_sense = LegacyEnglishTranslationSense(meaning, [])
+            self.translations.append(new_sense)
+            self._translation_guide[meaning] = new_sense
+
+        new_translation = LegacyEnglishTranslation(translation, alternate, literal, qualifier, transliteration)
+        self._translation_guide[meaning].translations.append(new_translation)
+
+
+def build_pages(db: sqlite3.Connection, cantonese_type, english_type) -> list:
+    # Mirrors the way dictionary_creator.py builds the pages, with the entry types swapped out
+    pages = {}
+    for id, traditional, simplified in db.execute("SELECT id, traditional, simplified FROM Entries"):
+        pages[id] = cantonese_type(id, traditional, simplified)
+    for id, definition in db.execute("SELECT id, definition FROM Definitions"):
+        pages[id].add_definition(definition)
+    for id, reading in db.execute("SELECT id, reading FROM Readings"):
+        pages[id].add_reading(reading)
+
+    result = [page for page in pages.values() if page.is_worth_adding()]
+
+    english = {}
+    for en, mean, trans, translit, alt, lit, qual in db.execute("SELECT * FROM EnglishTranslations"):
+        if en not in english:
+            english[en] = english_type(en)
+        english[en].add_translation(mean, trans, alt, lit, qual, translit)
+
+    return result + [*english.values()]
+
+
+def measure(database_path: str, cantonese_type, english_type) -> (int, int):
+    '''
+    Returns the number of pages and the number of bytes still allocated while they're held
+    '''
+    db = sqlite3.connect(database_path)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    pages = build_pages(db, cantonese_type, english_type)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    db.close()
+    return len(pages), held
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", type=str)
+    args = parser.parse_args()
+
+    layouts = [
+        ("previous", LegacyCantoneseEntry, LegacyEnglishEntry),
+        ("current", datatypes.CantoneseEntry, datatypes.EnglishEntry),
+    ]
+
+    results = {}
+    for name, cantonese_type, english_type in layouts:
+        count, held = measure(args.database, cantonese_type, english_type)
+        results[name] = held
+        print(f"{name:>8}: {held / 2**20:8.1f} MiB for {count} pages ({held / max(count, 1):.0f} bytes per page)")
+
+    reduction = 1 - results["current"] / results["previous"]
+    print(f"Reduction: {reduction:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+'''
+Times and measures the peak memory of each stage of the pipeline separately, on synthetic sources generated by
+synthetic_sources.py, and writes the results as JSON. Each stage is run in its own process the same way compile.sh
+runs it, so the numbers include interpreter start up and database access, but not the macOS only final build.
+
+python3 pipeline_benchmark.py --entries 100000 --pages 200000 --jobs 4 -o report.json
+'''
+
+from typing import Dict, List
+
+import argparse
+import platform
+import subprocess
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+from synthetic_sources import generate_sources
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run_stage(name: str, command: List[str], directory: str) -> Dict[str, float]:
+    '''
+    Run a single stage to completion, returning its wall and CPU time and peak resident memory
+    '''
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL)
+    # wait4 gives the resource usage of this process alone (and the workers it started and waited for)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"Stage {name} failed with exit code {process.returncode}")
+
+    # ru_maxrss is in bytes on macOS but in KiB on Linux
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+    return {
+        "wall_seconds": round(wall_time, 3),
+        "user_seconds": round(usage.ru_utime, 3),
+        "system_seconds": round(usage.ru_stime, 3),
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def run_benchmark(directory: str, entries: int, pages: int, jobs: int, seed: int) -> dict:
+    start = time.perf_counter()
+    sources = generate_sources(directory, entries, pages, seed)
+    generation_time = time.perf_counter() - start
+
+    database = os.path.join(directory, "database.db")
+    output = os.path.join(directory, "CantoneseDictionary.xml")
+
+    stages = [
+        # The source cache is skipped so the sources are parsed every time, as they would be on a first build
+        ("combiner", [sys.executable, os.path.join(ROOT, "Chinese Dictionary Converter", "cantonese_cedict_combiner.py"), "--no-cache"], directory),
+        ("extractor", [sys.executable, os.path.join(ROOT, "Wiktionary Converter", "wiktionary_translation_extractor.py"), sources["wiktionary"], "--jobs", str(jobs), "--no-cache"], directory),
+        ("creator", [sys.executable, os.path.join(ROOT, "Dictionary Creator", "dictionary_creator.py"), database, "-o", output, "--jobs", str(jobs)], directory),
+    ]
+
+    results = {}
+    for name, command, working_directory in stages:
+        results[name] = run_stage(name, command, working_directory)
+        print(f"{name:>10}: {results[name]['wall_seconds']:8.2f}s, peak {results[name]['peak_rss_bytes'] / 2**20:8.1f} MiB")
+
+    return {
+        "parameters": {"entries": entries, "pages": pages, "jobs": jobs, "seed": seed},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "generation_seconds": round(generation_time, 3),
+        "input_bytes": {name: os.path.getsize(path) for name, path in sources.items()},
+        "output_bytes": {"database": os.path.getsize(database), "dictionary": os.path.getsize(output)},
+        "stages": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=20000, help="number of synthetic CC-CEDICT entries")
+    parser.add_argument("--pages", type=int, default=50000, help="number of synthetic Wiktionary pages")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="passed on to the stages which support it")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", type=str, help="directory to generate into and keep, rather than a temporary one")
+    parser.add_argument("-o", type=str, default="benchmark_report.json", help="where to write the JSON report")
+    args = parser.parse_args()
+
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+        report = run_benchmark(args.keep, args.entries, args.pages, args.jobs, args.seed)
+    else:
+        directory = tempfile.mkdtemp(prefix="cantonese_benchmark_")
+        try:
+            report = run_benchmark(directory, args.entries, args.pages, args.jobs, args.seed)
+        finally:
+            shutil.rmtree(directory)
+
+    with open(args.o, "w") as out_file:
+        json.dump(report, out_file, indent=4)
+
+    print(f"Report written to {args.o}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+'''
+Compares how long it takes to render each page with the Jinja2 templates and with the pre-compiled templates, and
+checks both produce exactly the same markup. Run it against a database produced by the converters (or by
+pipeline_benchmark.py with --keep):
+
+python3 render_benchmark.py "../Dictionary Creator/database.db"
+'''
+
+import argparse
+import itertools
+import time
+import sys
+import os
+
+CREATOR_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dictionary Creator")
+sys.path.append(CREATOR_DIRECTORY)
+
+from apple_dictionary_writer import AppleDictionaryWriter
+from dictionary_creator import create_cantonese_entries, create_english_pages
+
+
+def time_renderer(writer: AppleDictionaryWriter, pages: list, repeats: int) -> (float, list):
+    '''
+    Returns the best time taken to render every page, and the pages rendered
+    '''
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = [writer.renderers[type(page)](page) for page in pages]
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", type=str)
+    parser.add_argument("--limit", type=int, default=50000, help="maximum number of pages of each type to render")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = [
+        *itertools.islice(create_cantonese_entries(args.database), args.limit),
+        *itertools.islice(create_english_pages(args.database), args.limit),
+    ]
+
+    jinja_time, jinja_output = time_renderer(AppleDictionaryWriter([], precompiled=False), pages, args.repeats)
+    fast_time, fast_output = time_renderer(AppleDictionaryWriter([], precompiled=True), pages, args.repeats)
+
+    mismatches = sum(a != b for a, b in zip(jinja_output, fast_output))
+
+    count = max(len(pages), 1)
+    print(f"      jinja2: {jinja_time / count * 1e6:8.2f}us per page")
+    print(f"pre-compiled: {fast_time / count * 1e6:8.2f}us per page")
+    print(f"     speedup: {jinja_time / fast_time:8.2f}x over {len(pages)} pages")
+    print(f"  mismatches: {mismatches}")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+'''
+Load tests dictionary_server.py. Queries are sampled from the keys of a binary dictionary (built by
+dictionary_creator.py --binary), a local server is started on it, and a number of connections send requests as fast
+as the server answers them. The latency percentiles, throughput and the server's render cache usage are printed, and
+written as JSON with -o.
+
+python3 server_benchmark.py dictionary.bin --requests 20000 --connections 16 -o report.json
+
+Pass --url to test a server which is already running instead (on the same dictionary, for the queries to be found).
+'''
+
+from typing import List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+import argparse
+import subprocess
+import platform
+import asyncio
+import random
+import socket
+import json
+import time
+import sys
+import os
+
+CREATOR_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dictionary Creator")
+sys.path.append(CREATOR_DIRECTORY)
+
+from binary_dictionary import BinaryDictionary
+from lookup_index import KEY_KINDS
+
+
+# Seconds to wait for a local server to start listening
+START_TIMEOUT = 60.0
+
+
+def sample_queries(path: str, count: int, html_ratio: float, prefix_ratio: float, seed: int) -> List[str]:
+    '''
+    Request targets for lookups of keys in the dictionary, of every kind, some as prefixes and some rendered
+    '''
+    random.seed(seed)
+    dictionary = BinaryDictionary(path)
+    keys = [(kind, key) for kind in KEY_KINDS for key in dictionary.keys(kind)]
+    dictionary.close()
+
+    if not keys:
+        raise ValueError(f"{path} has no keys to query")
+
+    targets = []
+    for kind, key in random.choices(keys, k=count):
+        target = f"/lookup?q={quote(key)}&kind={kind}"
+        if random.random() < prefix_ratio:
+            # A shorter prefix of the key finds more pages
+            target = f"/lookup?q={quote(key[:max(1, len(key) // 2)])}&kind={kind}&prefix=1&limit=10"
+        if random.random() < html_ratio:
+            target += "&format=html"
+        targets.append(target)
+    return targets
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    # Nearest rank, the values must be sorted
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))] if ordered else 0.0
+
+
+async def send_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, target: str) -> Tuple[int, bytes]:
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("ascii"))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def run_connection(host: str, port: int, targets: List[str], latencies: List[float], errors: List[str]):
+    # Each connection is kept open and sends its next request as soon as the last one is answered
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while targets:
+            target = targets.pop()
+            start = time.perf_counter()
+            status, _ = await send_request(reader, writer, host, target)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(f"{status} {target}")
+    finally:
+        writer.close()
+
+
+async def run_load(host: str, port: int, targets: List[str], connections: int) -> Tuple[List[float], List[str], float]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    # Shared by every connection, asyncio only switches between them while they wait for the server
+    pending = targets[::-1]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_connection(host, port, pending, latencies, errors) for _ in range(connections)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def fetch_stats(host: str, port: int) -> dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    _, body = await send_request(reader, writer, host, "/stats")
+    writer.close()
+    return json.loads(body)
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(path: str, port: int, cache_size: Optional[int]) -> subprocess.Popen:
+    command = [sys.executable, "dictionary_server.py", os.path.abspath(path), "--port", str(port)]
+    if cache_size is not None:
+        command += ["--cache-size", str(cache_size)]
+    server = subprocess.Popen(command, cwd=CREATOR_DIRECTORY, stdout=subprocess.DEVNULL)
+
+    # The dictionary is only memory-mapped, but the interpreter still takes a moment to start
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+
+    server.terminate()
+    raise RuntimeError(f"The server didn't start listening within {START_TIMEOUT:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dictionary", type=str, help="binary dictionary built by dictionary_creator.py --binary")
+    parser.add_argument("--url", type=str, help="address of a server which is already running, such as http://127.0.0.1:8080")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=16, help="number of connections sending requests at once")
+    parser.add_argument("--html", type=float, default=0.5, help="fraction of lookups asking for rendered pages")
+    parser.add_argument("--prefix", type=float, default=0.2, help="fraction of lookups searching by prefix")
+    parser.add_argument("--cache-size", type=int, help="render cache size for the local server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", type=str, help="write the report as JSON to this path")
+    args = parser.parse_args()
+
+    targets = sample_queries(args.dictionary, args.requests, args.html, args.prefix, args.seed)
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = "127.0.0.1", free_port()
+        server = start_server(args.dictionary, port, args.cache_size)
+
+    try:
+        latencies, errors, elapsed = asyncio.run(run_load(host, port, targets, args.connections))
+        stats = asyncio.run(fetch_stats(host, port))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    report = {
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "parameters": {"requests": args.requests, "connections": args.connections, "html": args.html, "prefix": args.prefix, "seed": args.seed},
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            name: round(value * 1000, 3)
+            for name, value in [
+                ("p50", percentile(latencies, 0.50)),
+                ("p90", percentile(latencies, 0.90)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else 0.0),
+            ]
+        },
+        "errors": len(errors),
+        "server": stats,
+    }
+
+    latency = report["latency_ms"]
+    print(f"{len(latencies)} requests over {args.connections} connections in {elapsed:.2f}s ({report['requests_per_second']} requests/s)")
+    print(f"latency p50 {latency['p50']}ms, p90 {latency['p90']}ms, p99 {latency['p99']}ms, max {latency['max']}ms")
+    cache = stats["render_cache"]
+    print(f"render cache {cache['hits']} hits, {cache['misses']} misses, {cache['size']} of {cache['max_size']} pages kept")
+    for error in errors[:10]:
+        print(f"error: {error}", file=sys.stderr)
+
+    if args.o:
+        with open(args.o, "w") as out_file:
+            json.dump(report, out_file, indent=2)
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
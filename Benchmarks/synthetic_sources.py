@@ -0,0 +1,192 @@
+'''
+Generates synthetic input files in the same formats as the real sources, so the converters can be run and measured
+without downloading them:
+
+- cedict_1_0_ts_utf-8_mdbg.txt: CC-CEDICT lines, traditional simplified [pin1 yin1] /def1/def2/
+- cccedict-canto-readings-150923.txt: CC-Canto readings, traditional simplified [pin1 yin1] {jyut6 ping3}
+- cccanto-webdist.txt: CC-Canto lines, traditional simplified [pin1 yin1] {jyut6 ping3} /def1/def2/
+- enwiktionary-synthetic-pages-articles.xml: Wiktionary pages, some with trans-top/t+ translation tables
+
+The output only depends on the sizes and seed given, so runs with the same arguments are comparable.
+'''
+
+from typing import Dict, List, Tuple
+
+import argparse
+import random
+import os
+
+
+CEDICT_NAME = "cedict_1_0_ts_utf-8_mdbg.txt"
+READINGS_NAME = "cccedict-canto-readings-150923.txt"
+CCCANTO_NAME = "cccanto-webdist.txt"
+WIKTIONARY_NAME = "enwiktionary-synthetic-pages-articles.xml"
+
+# Range of CJK Unified Ideographs characters are picked from
+CHARACTERS = [chr(code) for code in range(0x4E00, 0x4E00 + 3000)]
+
+ENGLISH_WORDS = [
+    "apple", "house", "water", "fire", "mountain", "river", "person", "to eat", "to drink", "big", "small", "red",
+    "to go", "to come", "book", "door", "dog", "cat", "bird", "fish", "tree", "flower", "sun", "moon", "star", "road",
+    "car", "boat", "money", "market", "teacher", "student", "friend", "family", "child", "old", "new", "good", "bad",
+    "to run", "to walk", "to see", "to hear", "to speak", "to write", "to read", "heart", "hand", "head", "eye",
+]
+
+PINYIN = ["ma", "ni", "hao", "shi", "zhong", "guo", "ren", "da", "xiao", "shan", "shui", "huo", "men", "jia", "yu"]
+JYUTPING = ["maa", "nei", "hou", "si", "zung", "gwok", "jan", "daai", "siu", "saan", "seoi", "fo", "mun", "gaa", "jyu"]
+
+Word = Tuple[str, str, str]
+
+
+def make_words(generator: random.Random, count: int) -> List[Word]:
+    words = []
+    seen = set()
+
+    while len(words) < count:
+        traditional = "".join(generator.choice(CHARACTERS) for _ in range(generator.randint(1, 4)))
+        if traditional in seen:
+            continue
+        seen.add(traditional)
+
+        # Roughly a third of words have a different simplified form
+        simplified = traditional
+        if generator.random() < 0.3:
+            simplified = "".join(chr(ord(character) + 3000) for character in traditional)
+
+        mandarin = " ".join(generator.choice(PINYIN) + str(generator.randint(1, 5)) for _ in traditional)
+        words.append((traditional, simplified, mandarin))
+
+    return words
+
+
+def jyutping(generator: random.Random, word: str) -> str:
+    return " ".join(generator.choice(JYUTPING) + str(generator.randint(1, 6)) for _ in word)
+
+
+def make_definitions(generator: random.Random) -> List[str]:
+    definitions = []
+    for _ in range(generator.randint(1, 4)):
+        definition = generator.choice(ENGLISH_WORDS)
+        if generator.random() < 0.2:
+            definition += " (of {})".format(generator.choice(ENGLISH_WORDS))
+        definitions.append(definition)
+    return definitions
+
+
+def write_cedict(path: str, generator: random.Random, words: List[Word]):
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write("# CC-CEDICT\n# Synthetic data for benchmarking\n")
+
+        for traditional, simplified, mandarin in words:
+            definitions = make_definitions(generator)
+            if generator.random() < 0.2:
+                classifier = generator.choice(words)
+                definitions.append("CL:{}|{}[{}]".format(*classifier))
+            if generator.random() < 0.05:
+                definitions.append("also pr. [{}]".format(mandarin))
+            if generator.random() < 0.05:
+                definitions.append("Taiwan pr. [{}]".format(mandarin))
+            if generator.random() < 0.1:
+                definitions.append("see {}|{}[{}]".format(*generator.choice(words)))
+
+            out_file.write("{} {} [{}] /{}/\n".format(traditional, simplified, mandarin, "/".join(definitions)))
+
+
+def write_readings(path: str, generator: random.Random, words: List[Word]):
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write("# CC-Canto readings\n")
+
+        for traditional, simplified, mandarin in words:
+            # Most words have a reading, some have more than one
+            for _ in range(generator.choice([0, 1, 1, 1, 1, 2])):
+                out_file.write("{} {} [{}] {{{}}}\n".format(traditional, simplified, mandarin, jyutping(generator, traditional)))
+
+
+def write_cccanto(path: str, generator: random.Random, words: List[Word], count: int):
+    # Half of the lines add to existing CC-CEDICT words, the rest are Cantonese only words
+    extra_words = make_words(random.Random(generator.random()), count)
+
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write("# CC-Canto\n")
+
+        for index in range(count):
+            traditional, simplified, mandarin = generator.choice(words) if index % 2 == 0 else extra_words[index]
+            definitions = make_definitions(generator)
+            if generator.random() < 0.2:
+                definitions.append("{} / {}".format(generator.choice(ENGLISH_WORDS), generator.choice(ENGLISH_WORDS)))
+            if generator.random() < 0.1:
+                definitions.append(" M: {}".format(generator.choice(words)[0]))
+
+            comment = " # adapted from cc-cedict" if index % 2 == 0 and generator.random() < 0.3 else ""
+            out_file.write("{} {} [{}] {{{}}} /{}/{}\n".format(
+                traditional, simplified, mandarin, jyutping(generator, traditional), "/".join(definitions), comment
+            ))
+
+
+def write_wiktionary(path: str, generator: random.Random, words: List[Word], count: int):
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n')
+        out_file.write("  <siteinfo>\n    <sitename>Wiktionary</sitename>\n  </siteinfo>\n")
+
+        for index in range(count):
+            title = "{}{}".format(generator.choice(ENGLISH_WORDS).replace("to ", ""), index)
+            out_file.write("  <page>\n    <title>{}</title>\n    <ns>0</ns>\n    <id>{}</id>\n".format(title, index + 1))
+            out_file.write('    <revision>\n      <text xml:space="preserve">==English==\n\n===Noun===\n')
+            out_file.write("{{en-noun}}\n\n# A synthetic definition.\n# Another definition.\n\n")
+
+            # Roughly a quarter of pages have translation tables, like the real dump
+            if generator.random() < 0.25:
+                out_file.write("====Translations====\n")
+                for sense in range(generator.randint(1, 3)):
+                    out_file.write("{{trans-top|id=sense" + str(sense) + "|a sense &quot;" + str(sense) + "&quot;}}\n")
+                    out_file.write("* French: {{t+|fr|chose|f}}\n* German: {{t|de|Ding|n}}\n")
+                    out_file.write("* Chinese:\n")
+                    if generator.random() < 0.6:
+                        traditional, simplified, _ = generator.choice(words)
+                        out_file.write("*: Cantonese: {{qualifier|colloquial}} {{t|yue|" + traditional + "|tr=" + jyutping(generator, traditional) + "}}\n")
+                    traditional, simplified, _ = generator.choice(words)
+                    out_file.write("*: Mandarin: {{t+|cmn|" + traditional + "}}, {{t+|cmn|" + simplified + "|alt=x}}\n")
+                    out_file.write("{{trans-mid}}\n* Japanese: {{t+|ja|物}}\n{{trans-bottom}}\n")
+
+            out_file.write("      </text>\n    </revision>\n  </page>\n")
+
+        out_file.write("</mediawiki>\n")
+
+
+def generate_sources(directory: str, entries: int, pages: int, seed: int = 0) -> Dict[str, str]:
+    '''
+    Write all four sources into directory, returning the path of each
+    '''
+    generator = random.Random(seed)
+    words = make_words(generator, entries)
+
+    paths = {
+        "cedict": os.path.join(directory, CEDICT_NAME),
+        "readings": os.path.join(directory, READINGS_NAME),
+        "cccanto": os.path.join(directory, CCCANTO_NAME),
+        "wiktionary": os.path.join(directory, WIKTIONARY_NAME),
+    }
+
+    write_cedict(paths["cedict"], generator, words)
+    write_readings(paths["readings"], generator, words)
+    write_cccanto(paths["cccanto"], generator, words, max(entries // 5, 1))
+    write_wiktionary(paths["wiktionary"], generator, words, pages)
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", type=str)
+    parser.add_argument("--entries", type=int, default=100000, help="number of CC-CEDICT entries")
+    parser.add_argument("--pages", type=int, default=200000, help="number of Wiktionary pages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    for name, path in generate_sources(args.directory, args.entries, args.pages, args.seed).items():
+        print(f"{name}: {path} ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ Takes CC-CEDICT and CC-Canto and combines them into a single database containing
 readings with the schema
 
 CREATE TABLE Entries (
-    id INT PRIMARY KEY,
+    id INT PRIMARY KEY, -- Hashed from the traditional, simplified and Mandarin forms, the same from build to build
     traditional STRING, -- Traditional character representation
     simplified STRING   -- Simplified character representation
 )
@@ -18,140 +18,466 @@ CREATE TABLE Readings (
     reading STRING      -- A single Cantonese reading relating to the entry at id
 )
 
+CREATE TABLE CrossReferences (
+    id INT REFERENCES Entries,
+    type STRING,                   -- classifier, measure word or pronunciation
+    target INT REFERENCES Entries, -- The entry referred to by the entry at id
+    label STRING                   -- Traditional characters of the entry referred to
+)
+
+CREATE TABLE LinkTargets (
+    form STRING PRIMARY KEY,       -- Traditional or simplified characters
+    target INT REFERENCES Entries  -- The entry translations into the form link to
+)
+
 Files to use with this converter can be found at:
 CC-Canto & CC-Canto readings: http://cccanto.org/download.html
 CC-CEDICT: https://www.mdbg.net/chinese/dictionary?page=cc-cedict
 """
 
+import hashlib
 import re
+import os
+import sys
+import argparse
 import sqlite3
 
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Modules shared between the converters live in the Shared directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+
+from bulk_loader import BulkLoader
+from instrumentation import Progress, instrument_stage, phase
+from source_cache import SourceCache
+
 DATABASE_NAME = "database.db"
 
-db = sqlite3.connect(DATABASE_NAME)
-cursor = db.cursor()
+CEDICT_NAME = "cedict_1_0_ts_utf-8_mdbg.txt"
+READINGS_NAME = "cccedict-canto-readings-150923.txt"
+CCCANTO_NAME = "cccanto-webdist.txt"
 
-# Prepare the Database
-cursor.execute("""
-CREATE TABLE Entries (
-    id INT PRIMARY KEY,
-    traditional STRING, -- Traditional character representation
-    simplified STRING   -- Simplified character representation
-)
-""")
+# Bump whenever the parsed entries change, so entries cached by older versions aren't used
+PARSER_VERSION = 2
 
-cursor.execute("""
-CREATE TABLE Definitions (
-    id INT REFERENCES Entries,
-    definition STRING   -- A single definition relating to the entry at id
-)
-""")
+# A word referred to in a CC-CEDICT reference, traditional|simplified[pin1 yin1] or traditional[pin1 yin1]
+REFERENCE_PATTERN = re.compile(r"([^\s,|\[\]/]+)(?:\|([^\s,|\[\]/]+))?\[([^\]]+)\]")
+# Mandarin readings in brackets, as given by "also pr. [pin1 yin1]"
+MANDARIN_PATTERN = re.compile(r"\[([^\]]+)\]")
+# Introduces the measure words in a CC-Canto definition. The spaces matter, "AM:" or "PM:" in a definition isn't one
+MEASURE_WORD_MARKER = " M: "
+# Separates the measure words given by a CC-Canto " M: " reference
+MEASURE_WORD_SEPARATOR = re.compile(r"[\s,;，；、]+")
 
-cursor.execute("""
-CREATE TABLE Readings (
-    id INT REFERENCES Entries,
-    reading STRING      -- A single Cantonese reading relating to the entry at id
-)
-""")
-
-# Create a map of entries and their entry id
-word_mappings = {}
-index_counter = 0
-
-# Parse the CEDict file
-with open("cedict_1_0_ts_utf-8_mdbg.txt") as in_file:
-    for line in in_file:
-        # Ignore commented out lines
-        if line.startswith("#"):
-            continue
-
-        # Parse lines of the format 
-        # traditional simplified [Mandarin] /def1/def2/.../defn/
-        traditional, simplified = line.split(" ")[:2]
-        mandarin = line[line.index("[")+1:line.index("]")]
-        definitions = line[line.index("/")+1:line.rfind("/")].split("/")
-        # Filter out cross references
-        definitions = filter(lambda x: "CL:" not in x, definitions)
-        # Filter out Taiwanese pronunciations
-        definitions = filter(lambda x: "Taiwan pr." not in x, definitions)
-        # Filter out alternate pronunciations
-        definitions = filter(lambda x: "also pr." not in x, definitions)
-        # Filter out mandarin pronunciations in definitions
-        definitions = map(lambda x: re.sub(r"\[.*?\]", "", x), definitions)
-        definitions = [*definitions]
-
-        index_counter += 1
-        word_mappings[(traditional, simplified, mandarin)] = index_counter
-
-        cursor.execute("INSERT INTO Entries VALUES (?, ?, ?)", (index_counter, traditional, simplified))
-        for definition in definitions:
-            cursor.execute("INSERT INTO Definitions VALUES (?, ?)", (index_counter, definition))
-
-with open("cccedict-canto-readings-150923.txt") as in_file:
-    for line in in_file:
-        # Ignore commented out lines
-        if line.startswith("#"):
-            continue
-
-        # Parse lines of the format
-        # traditional simplified [mandarin] {cantonese}
-        traditional, simplified = line.split(" ")[:2]
-        mandarin = line[line.index("[")+1:line.index("]")]
-        cantonese = line[line.index("{")+1:line.index("}")]
-
-        try:
-            translation_id = word_mappings[(traditional, simplified, mandarin)]
-        except KeyError:
-            continue
-
-        cursor.execute("INSERT INTO Readings VALUES (?, ?)", (translation_id, cantonese))
-
-with open("cccanto-webdist.txt") as in_file:
-    for line in in_file:
-        # Ignore commented out lines
-        if line.startswith("#"):
-            continue
-
-        # Parse lines of the format 
-        # traditional simplified [Mandarin] /def1/def2/.../defn/
-        traditional, simplified = line.split(" ")[:2]
-        mandarin = line[line.index("[")+1:line.index("]")]
-        cantonese = line[line.index("{")+1:line.index("}")]
-        
-        # Trim to the start and end of the definitions
-        definitions = line[line.index("/")+1:line.rfind("/")]
-        # Replace slashes with spaces around them with the comment marker (definitely not used character), 
-        # they are one continuous definition
-        definitions = definitions.replace(" / ", "#")
-        # Split the definitions
-        definitions = definitions.split("/")
-        # Change the #es back to /es
-        definitions = [x.replace("#", "/") for x in definitions]
-        # Filter out cross references
-        definitions = filter(lambda x: " M: " not in x, definitions)
-        # Remove whitespace from definitions
-        definitions = map(lambda x: x.strip(), definitions)
-
-        if (traditional, simplified, mandarin) in word_mappings:
-            definition_id = word_mappings[(traditional, simplified, mandarin)]
-            cursor.execute("INSERT INTO Readings VALUES (?, ?)", (definition_id, cantonese))
+# (type, traditional, simplified, mandarin) of a word referred to by an entry, only the traditional form is certain
+Reference = Tuple[str, str, Optional[str], Optional[str]]
+
+
+class CombinedEntry:
+    '''
+    A single word from any of the sources, keyed on (traditional, simplified, mandarin). Readings and
+    definitions are kept in the order they are first seen, without duplicates (dicts keep insertion order).
+    '''
+    def __init__(self, traditional: str, simplified: str, from_cedict: bool):
+        self.traditional = traditional
+        self.simplified = simplified
+        self.from_cedict = from_cedict
+        self.readings: Dict[str, None] = {}
+        self.definitions: Dict[str, None] = {}
+        self.references: Dict[Reference, None] = {}
+
+    def add_readings(self, readings: Iterable[str]):
+        for reading in map(str.strip, readings):
+            if reading != "":
+                self.readings[reading] = None
+
+    def add_definitions(self, definitions: Iterable[str]):
+        for definition in map(str.strip, definitions):
+            if definition != "":
+                self.definitions[definition] = None
+
+    def add_references(self, references: Iterable[Reference]):
+        for reference in references:
+            self.references[reference] = None
+
+
+EntryKey = Tuple[str, str, str]
+
+
+def parse_cedict_references(traditional: str, simplified: str, definitions: List[str]) -> List[Reference]:
+    '''
+    Get the classifiers (CL:) and alternate pronunciations (also pr.) of an entry from its CC-CEDICT definitions
+    '''
+    references = []
+
+    for definition in definitions:
+        if "CL:" in definition:
+            for word, word_simplified, mandarin in REFERENCE_PATTERN.findall(definition[definition.index("CL:") + 3:]):
+                references.append(("classifier", word, word_simplified or word, mandarin))
+        if "also pr." in definition:
+            for mandarin in MANDARIN_PATTERN.findall(definition[definition.index("also pr."):]):
+                references.append(("pronunciation", traditional, simplified, mandarin))
+
+    return references
+
+
+def parse_cccanto_references(definitions: List[str]) -> List[Reference]:
+    '''
+    Get the measure words (M:) of an entry from its CC-Canto definitions, which only give the traditional form
+    '''
+    references = []
+
+    for definition in definitions:
+        if MEASURE_WORD_MARKER in definition:
+            for word in MEASURE_WORD_SEPARATOR.split(definition[definition.index(MEASURE_WORD_MARKER) + len(MEASURE_WORD_MARKER):]):
+                if word != "" and not word.isascii():
+                    references.append(("measure word", word, None, None))
+
+    return references
+
+
+def parse_cedict(path: str, entries: Dict[EntryKey, CombinedEntry]):
+    progress = Progress(os.path.basename(path), os.path.getsize(path))
+
+    with open(path) as in_file:
+        for line in in_file:
+            progress.update(len(line.encode("utf-8")), 1)
+
+            # Ignore commented out lines
+            if line.startswith("#"):
+                continue
+
+            # Parse lines of the format 
+            # traditional simplified [Mandarin] /def1/def2/.../defn/
+            traditional, simplified = line.split(" ")[:2]
+            mandarin = line[line.index("[")+1:line.index("]")]
+            definitions = line[line.index("/")+1:line.rfind("/")].split("/")
+            references = parse_cedict_references(traditional, simplified, definitions)
+            # Filter out cross references, they're kept as references instead
+            definitions = filter(lambda x: "CL:" not in x, definitions)
+            # Filter out Taiwanese pronunciations
+            definitions = filter(lambda x: "Taiwan pr." not in x, definitions)
+            # Filter out alternate pronunciations
+            definitions = filter(lambda x: "also pr." not in x, definitions)
+            # Filter out mandarin pronunciations in definitions
+            definitions = map(lambda x: re.sub(r"\[.*?\]", "", x), definitions)
+
+            key = (traditional, simplified, mandarin)
+            if key not in entries:
+                entries[key] = CombinedEntry(traditional, simplified, True)
+            entries[key].add_definitions(definitions)
+            entries[key].add_references(references)
+
+    progress.finish()
+
+
+def parse_readings(path: str, entries: Dict[EntryKey, CombinedEntry]):
+    progress = Progress(os.path.basename(path), os.path.getsize(path))
+
+    with open(path) as in_file:
+        for line in in_file:
+            progress.update(len(line.encode("utf-8")), 1)
+
+            # Ignore commented out lines
+            if line.startswith("#"):
+                continue
+
+            # Parse lines of the format
+            # traditional simplified [mandarin] {cantonese}
+            traditional, simplified = line.split(" ")[:2]
+            mandarin = line[line.index("[")+1:line.index("]")]
+            cantonese = line[line.index("{")+1:line.index("}")]
+
+            entry = entries.get((traditional, simplified, mandarin))
+            if entry is not None:
+                entry.add_readings([cantonese])
+
+    progress.finish()
+
+
+def parse_cccanto(path: str, entries: Dict[EntryKey, CombinedEntry]):
+    progress = Progress(os.path.basename(path), os.path.getsize(path))
+
+    with open(path) as in_file:
+        for line in in_file:
+            progress.update(len(line.encode("utf-8")), 1)
+
+            # Ignore commented out lines
+            if line.startswith("#"):
+                continue
+
+            # Parse lines of the format 
+            # traditional simplified [Mandarin] /def1/def2/.../defn/
+            traditional, simplified = line.split(" ")[:2]
+            mandarin = line[line.index("[")+1:line.index("]")]
+            cantonese = line[line.index("{")+1:line.index("}")]
+            
+            # Trim to the start and end of the definitions
+            definitions = line[line.index("/")+1:line.rfind("/")]
+            # Replace slashes with spaces around them with the comment marker (definitely not used character), 
+            # they are one continuous definition
+            definitions = definitions.replace(" / ", "#")
+            # Split the definitions
+            definitions = definitions.split("/")
+            # Change the #es back to /es
+            definitions = [x.replace("#", "/") for x in definitions]
+            references = parse_cccanto_references(definitions)
+            # Filter out cross references, they're kept as references instead
+            definitions = filter(lambda x: MEASURE_WORD_MARKER not in x, definitions)
+
+            key = (traditional, simplified, mandarin)
+            if key not in entries:
+                entries[key] = CombinedEntry(traditional, simplified, False)
+            entry = entries[key]
 
             # These lines are adapted from the original CC-CEDICT, and elaborate on already provided
             # definitions, so previous definitions need to be removed
-            if "# adapted from cc-cedict" in line:
-                cursor.execute("DELETE FROM Definitions WHERE id=?", (definition_id,))
+            if entry.from_cedict and "# adapted from cc-cedict" in line:
+                entry.definitions.clear()
 
+            entry.add_readings([cantonese])
+            entry.add_definitions(definitions)
+            entry.add_references(references)
+
+    progress.finish()
+
+
+def combine_sources(cedict_path: str = CEDICT_NAME, readings_path: str = READINGS_NAME, cccanto_path: str = CCCANTO_NAME) -> Dict[EntryKey, CombinedEntry]:
+    '''
+    Merge all three sources in memory, so each entry, reading and definition only has to be written once
+    '''
+    entries: Dict[EntryKey, CombinedEntry] = {}
+    parse_cedict(cedict_path, entries)
+    parse_readings(readings_path, entries)
+    parse_cccanto(cccanto_path, entries)
+    return entries
+
+
+def load_sources(directory: str = "", use_cache: bool = True) -> Dict[EntryKey, CombinedEntry]:
+    '''
+    Combine the sources in a directory, taking the entries from the source cache if the sources haven't changed
+    '''
+    sources = [os.path.join(directory, name) for name in [CEDICT_NAME, READINGS_NAME, CCCANTO_NAME]]
+    if not use_cache:
+        return combine_sources(*sources)
+
+    parse = lambda: pack_entries(combine_sources(*sources))
+    return unpack_entries(SourceCache().load_or_parse("combiner", sources, PARSER_VERSION, parse))
+
+
+def pack_entries(entries: Dict[EntryKey, CombinedEntry]) -> List[tuple]:
+    # Plain tuples for the source cache, which can be loaded whatever module the entries were made in
+    return [
+        (key, entry.from_cedict, [*entry.readings], [*entry.definitions], [*entry.references])
+        for key, entry in entries.items()
+    ]
+
+
+def unpack_entries(rows: List[tuple]) -> Dict[EntryKey, CombinedEntry]:
+    entries = {}
+    for key, from_cedict, readings, definitions, references in rows:
+        entry = entries[key] = CombinedEntry(key[0], key[1], from_cedict)
+        entry.readings = dict.fromkeys(readings)
+        entry.definitions = dict.fromkeys(definitions)
+        entry.references = dict.fromkeys(references)
+    return entries
+
+
+def content_id(key: EntryKey, attempt: int = 0) -> int:
+    # The top 63 bits of the hash, so ids are always positive SQLite integers
+    digest = hashlib.blake2b("\0".join([*key, str(attempt)]).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 1
+
+
+def entry_ids(keys: Iterable[EntryKey]) -> Dict[EntryKey, int]:
+    '''
+    Give each entry an id hashed from its key, so an entry keeps its id however the sources around it change
+    '''
+    ids: Dict[EntryKey, int] = {}
+    used = set()
+
+    # A key whose id is taken is hashed again with a counter. Keys are taken in sorted order, so which of two
+    # colliding keys moves on doesn't depend on where they are in the sources
+    for key in sorted(keys):
+        attempt = 0
+        while content_id(key, attempt) in used:
+            attempt += 1
+        ids[key] = content_id(key, attempt)
+        used.add(ids[key])
+
+    return ids
+
+
+def index_targets(entries: Dict[EntryKey, CombinedEntry], ids: Dict[EntryKey, int]) -> Dict[tuple, int]:
+    '''
+    Map the (traditional, simplified, mandarin), (traditional, simplified) and (traditional,) keys of every entry
+    which can be referred to to its id, the first entry with a key is the one referred to
+    '''
+    targets = {}
+
+    for key, entry in entries.items():
+        # Entries without readings or definitions don't end up in the dictionary, so they can't be linked to
+        if entry.readings and entry.definitions:
+            for target_key in [key, key[:2], key[:1]]:
+                targets.setdefault(target_key, ids[key])
+
+    return targets
+
+
+def resolve_reference(reference: Reference, targets: Dict[tuple, int]) -> Optional[int]:
+    _, traditional, simplified, mandarin = reference
+
+    # The most specific key given by the reference is tried first
+    if simplified is not None and mandarin is not None and (traditional, simplified, mandarin) in targets:
+        return targets[(traditional, simplified, mandarin)]
+    if reference[0] != "pronunciation":
+        if simplified is not None and (traditional, simplified) in targets:
+            return targets[(traditional, simplified)]
+        return targets.get((traditional,))
+    return None
+
+
+# An entry as it's written to the database: (id, traditional, simplified, definitions, readings, references), with
+# references resolved to (type, target id, label)
+EntryRow = Tuple[int, str, str, List[str], List[str], List[Tuple[str, int, str]]]
+
+
+def number_entries(entries: Dict[EntryKey, CombinedEntry]) -> Iterator[EntryRow]:
+    '''
+    Give each entry its id (see entry_ids()), in the order the entries were first seen, with its references resolved
+    to the ids of the entries they refer to
+    '''
+    ids = entry_ids(entries)
+    # References are resolved to entry ids with a hash lookup each, once every id is known
+    targets = index_targets(entries, ids)
+
+    for key, entry in entries.items():
+        references = {}
+        for reference in entry.references:
+            target = resolve_reference(reference, targets)
+            # References which can't be found, or lead back to the same entry, are left out
+            if target is not None and target != ids[key]:
+                references.setdefault((reference[0], target), reference[1])
+
+        yield (
+            ids[key],
+            entry.traditional,
+            entry.simplified,
+            [*entry.definitions],
+            [*entry.readings],
+            [(type, target, label) for (type, target), label in references.items()],
+        )
+
+
+def index_forms(entries: Iterable[EntryRow], traditional_forms: Dict[str, int], simplified_forms: Dict[str, int]) -> Iterator[EntryRow]:
+    '''
+    Record the first entry with each traditional and each simplified form as the entries pass through, in the order
+    the sources give them, see link_targets()
+    '''
+    for entry in entries:
+        id, traditional, simplified, definitions, readings, _ = entry
+        # Entries without readings or definitions don't end up in the dictionary, so they can't be linked to
+        if readings and definitions:
+            traditional_forms.setdefault(traditional, id)
+            simplified_forms.setdefault(simplified, id)
+        yield entry
+
+
+def link_targets(traditional_forms: Dict[str, int], simplified_forms: Dict[str, int]) -> Dict[str, int]:
+    '''
+    Map each form to the entry translations into it link to. A traditional form links to the same entry a reference to
+    it leads to (see index_targets()), ahead of any entry which is only simplified to it
+    '''
+    return {**simplified_forms, **traditional_forms}
+
+
+def write_database(entries: Iterable[EntryRow], db: sqlite3.Connection):
+    cursor = db.cursor()
+
+    # Prepare the Database
+    cursor.execute("""
+    CREATE TABLE Entries (
+        id INT PRIMARY KEY,
+        traditional STRING, -- Traditional character representation
+        simplified STRING   -- Simplified character representation
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE Definitions (
+        id INT REFERENCES Entries,
+        definition STRING   -- A single definition relating to the entry at id
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE Readings (
+        id INT REFERENCES Entries,
+        reading STRING      -- A single Cantonese reading relating to the entry at id
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE CrossReferences (
+        id INT REFERENCES Entries,
+        type STRING,                   -- classifier, measure word or pronunciation
+        target INT REFERENCES Entries, -- The entry referred to by the entry at id
+        label STRING                   -- Traditional characters of the entry referred to
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE LinkTargets (
+        form STRING PRIMARY KEY,       -- Traditional or simplified characters
+        target INT REFERENCES Entries  -- The entry translations into the form link to
+    )
+    """)
+
+    # Which entry a form links to is only known once every entry has been seen
+    traditional_forms: Dict[str, int] = {}
+    simplified_forms: Dict[str, int] = {}
+
+    # Rows are written by a separate thread while the next ones are built
+    with BulkLoader(db, background=True) as loader:
+        # The id columns are only indexed once everything is loaded
+        loader.create_index("Definitions", "id")
+        loader.create_index("Readings", "id")
+        loader.create_index("CrossReferences", "id")
+
+        for index, traditional, simplified, definitions, readings, references in index_forms(entries, traditional_forms, simplified_forms):
+            loader.insert("Entries", (index, traditional, simplified))
             for definition in definitions:
-                cursor.execute("INSERT INTO Definitions VALUES (?, ?)", (definition_id, definition))
-        else:
-            index_counter += 1
-            cursor.execute("INSERT INTO Entries VALUES (?, ?, ?)", (index_counter, traditional, simplified))
-            cursor.execute("INSERT INTO Readings VALUES (?, ?)", (index_counter, cantonese))
-            
-            for definition in definitions:
-                cursor.execute("INSERT INTO Definitions VALUES (?, ?)", (index_counter, definition))
+                loader.insert("Definitions", (index, definition))
+            for reading in readings:
+                loader.insert("Readings", (index, reading))
+            for type, target, label in references:
+                loader.insert("CrossReferences", (index, type, target, label))
+
+        for form, target in link_targets(traditional_forms, simplified_forms).items():
+            loader.insert("LinkTargets", (form, target))
+
+    cursor.close()
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", type=str, help="write cProfile statistics for the run to this path")
+    parser.add_argument("--no-cache", action="store_true", help="parse the sources even if they haven't changed since the last run")
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+
+    with instrument_stage("combiner", args.profile):
+        with phase("parse"):
+            entries = load_sources(use_cache=not args.no_cache)
+
+        # The bulk loader writes from its own thread
+        db = sqlite3.connect(DATABASE_NAME, check_same_thread=False)
+        write_database(number_entries(entries), db)
+        db.close()
 
 
-cursor.close()
-db.commit()
-db.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,102 @@
-import xml.etree.ElementTree as ElementTree
+import hashlib
+import multiprocessing
+import math
+import sys
+import os
+import re
 
-from typing import Set
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+from xml.sax.saxutils import escape
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from datatypes import *
+from fragment_cache import FragmentCache
+from fast_templates import compile_templates
+
+# Modules shared with the converters live in the Shared directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+
+from instrumentation import phase
+
+
+# Templates are found next to this file, wherever the dictionary is built from
+ASSETS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+DICTIONARY_HEADER = (
+    "<?xml version='1.0' encoding='UTF-8'?>\n"
+    "<d:dictionary"
+    " xmlns=\"http://www.w3.org/1999/xhtml\""
+    " xmlns:d=\"http://www.apple.com/DTDs/DictionaryService-1.0.rng\">"
+)
+
+DICTIONARY_FOOTER = "</d:dictionary>"
+
+# Part of the signature of cached fragments. Bump it whenever the markup written around or instead of the templates
+# changes (generate_entry(), the builders in fast_templates.py, remove_blanks()), so fragments rendered by older code
+# aren't reused
+FORMAT_VERSION = 1
+
+# Number of pages sent to a worker process at a time when rendering in parallel
+CHUNK_SIZE = 500
+
+# Whitespace between two tags, which is all xmllint --noblanks removes from the pages. Text in the pages is escaped,
+# so a < or > can only be part of a tag, and only XML whitespace is matched (not the ideographic space)
+BLANK_PATTERN = re.compile(r"(<[^<>]*>)[ \t\r\n]+(?=<(/?))")
+
+# The writer used to render pages inside a worker process, created once by the pool initialiser
+_worker_writer = None
+
+
+def format_attributes(attributes: Dict[str, str]) -> str:
+    # Escape the same characters ElementTree does when serialising attribute values
+    return "".join(
+        " {}=\"{}\"".format(name, escape(value, {"\"": "&quot;", "\n": "&#10;"}))
+        for name, value in attributes.items()
+    )
+
+
+def chunk_pages(pages: Iterable[Entry], size: int) -> Iterator[List[Entry]]:
+    iterator = iter(pages)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def remove_blanks(markup: str) -> str:
+    # Like xmllint, whitespace which is all there is inside an element is kept, anywhere else it's dropped
+    return BLANK_PATTERN.sub(
+        lambda match: match.group(0) if match.group(2) and match.group(1)[1] != "/" and match.group(1)[-2] != "/" else match.group(1),
+        markup
+    )
+
+
+def shard_path(output_location: str, index: int) -> str:
+    # CantoneseDictionary.xml becomes CantoneseDictionary.000.xml, CantoneseDictionary.001.xml, ...
+    root, extension = os.path.splitext(output_location)
+    return f"{root}.{index:03d}{extension}"
+
+
+def initialise_worker(precompiled: bool, minify: bool):
+    global _worker_writer
+    _worker_writer = AppleDictionaryWriter([], precompiled, minify)
+
+
+def generate_chunk(pages: List[Entry]) -> List[str]:
+    return [*map(_worker_writer.generate_entry, pages)]
 
 
 class AppleDictionaryWriter:
-    def __init__(self, pages: Set[Entry]):
-        dict_entries = filter(lambda x: isinstance(x, CantoneseEntry), pages)
-        self.full_entries = set(map(lambda x: x.page_title, dict_entries))
-
-        self.root: ElementTree.Element = ElementTree.Element(
-            "d:dictionary",
-            {
-                "xmlns": "http://www.w3.org/1999/xhtml",
-                "xmlns:d": "http://www.apple.com/DTDs/DictionaryService-1.0.rng"
-            }
-        )
+    def __init__(self, pages: Iterable[Entry], precompiled: bool = True, minify: bool = False):
+        # Pages are only iterated once, in write(), so a generator can be given to keep memory usage flat
+        self.pages = pages
+        self.precompiled = precompiled
+        # Leave out the whitespace between tags, the same as running the output through xmllint --noblanks
+        self.minify = minify
 
         self.environment = Environment(
-            loader=FileSystemLoader("assets"),
+            loader=FileSystemLoader(ASSETS_DIRECTORY),
             autoescape=select_autoescape(enabled_extensions=('html', 'xml'), default_for_string=True)
         )
 
@@ -28,35 +105,175 @@ class AppleDictionaryWriter:
             EnglishEntry: self.environment.get_template("english_entry.html")
         }
 
-        for page in pages:
-            self.generate_entry(page)
+        # Renders each type of page, with builders pre-compiled from the templates unless told to use Jinja2
+        if precompiled:
+            self.renderers = compile_templates(self.templates)
+        else:
+            self.renderers = {
+                entry_type: lambda page, template=template: template.render(entry=page)
+                for entry_type, template in self.templates.items()
+            }
+
+    def signature(self) -> str:
+        # Changes whenever the templates or the way they're written do, so cached fragments rendered differently
+        # aren't reused
+        signature = hashlib.sha1(f"format {FORMAT_VERSION}\n".encode("utf-8"))
+        for template in self.templates.values():
+            with open(template.filename, "rb") as template_file:
+                signature.update(template_file.read())
+        if self.minify:
+            signature.update(b"minify")
+        return signature.hexdigest()
 
-    def generate_entry(self, page: Entry):
-        entry_node = None
+    def generate_entry(self, page: Entry) -> str:
+        fragment: List[str] = []
 
         if isinstance(page, CantoneseEntry):
-            entry_node = ElementTree.SubElement(self.root, "d:entry", {"id": page.page_id, "d:title": page.traditional})
+            fragment.append("<d:entry{}>".format(format_attributes({"id": page.page_id, "d:title": page.traditional})))
 
-            ElementTree.SubElement(entry_node, "d:index", {"d:title": page.traditional, "d:value": page.traditional})
+            fragment.append("<d:index{} />".format(format_attributes({"d:title": page.traditional, "d:value": page.traditional})))
             # Add an index for the simplified character variant if there is one
             if page.traditional != page.simplified:
-                ElementTree.SubElement(entry_node, "d:index", {"d:title": page.traditional, "d:value": page.simplified})
+                fragment.append("<d:index{} />".format(format_attributes({"d:title": page.traditional, "d:value": page.simplified})))
 
             # Add readings
             for reading in page.readings:
-                ElementTree.SubElement(entry_node, "d:index", {"d:yomi": reading, "d:title": page.traditional, "d:value": reading})
+                fragment.append("<d:index{} />".format(format_attributes({"d:yomi": reading, "d:title": page.traditional, "d:value": reading})))
 
         elif isinstance(page, EnglishEntry):
-            entry_node = ElementTree.SubElement(self.root, "d:entry", {"id": page.page_id, "d:title": page.page_title})
-            ElementTree.SubElement(entry_node, "d:index", {"d:title": page.page_title, "d:value": page.page_title})
+            fragment.append("<d:entry{}>".format(format_attributes({"id": page.page_id, "d:title": page.page_title})))
+            fragment.append("<d:index{} />".format(format_attributes({"d:title": page.page_title, "d:value": page.page_title})))
+
+        # Create the page body from the templates
+        entry_html = self.renderers[type(page)](page)
+
+        # Strip the enclosing <body> tags so the page body elements become children of the entry node,
+        # the rendered markup is written as is rather than being parsed back into a tree
+        fragment.append(entry_html[entry_html.index(">") + 1:entry_html.rindex("<")].lstrip())
+        fragment.append("</d:entry>")
+
+        if self.minify:
+            return remove_blanks("".join(fragment))
+        return "".join(fragment)
+
+    def write(self, output_location: str, jobs: int = 1, cache: Optional[FragmentCache] = None, shards: int = 1, page_count: Optional[int] = None) -> List[str]:
+        '''
+        Write the pages to output_location, or split them between several shards written next to it, each a complete
+        dictionary document holding a run of consecutive pages (page_count, an estimate of the number of pages, is
+        needed to size them). Returns the paths written.
+        '''
+        if shards > 1 and page_count is None:
+            raise ValueError("Writing more than one shard needs the page count, to size the shards")
+
+        pool = multiprocessing.Pool(jobs, initialise_worker, (self.precompiled, self.minify)) if jobs > 1 else None
+
+        try:
+            paths = self._write_pages(output_location, jobs, pool, cache, shards, page_count)
+            if pool is not None:
+                pool.close()
+                pool.join()
+            return paths
+        finally:
+            # Stops the workers if rendering or writing failed, once they've been joined there's nothing left to stop
+            if pool is not None:
+                pool.terminate()
+
+    def _write_pages(self, output_location: str, jobs: int, pool, cache: Optional[FragmentCache], shards: int, page_count: Optional[int]) -> List[str]:
+        if shards > 1:
+            paths = [shard_path(output_location, index) for index in range(shards)]
+            chunks_per_shard = max(math.ceil(page_count / CHUNK_SIZE / shards), 1)
+        else:
+            paths = [output_location]
+            chunks_per_shard = math.inf
+
+        outputs = iter(paths)
+        out_file = None
+        chunks_written = 0
+
+        # Each entry is written out as soon as it is generated, nothing is kept once it has been written
+        pending = deque()
+
+        for chunk in chunk_pages(self.pages, CHUNK_SIZE):
+            with phase("template render"):
+                pending.append(self._submit_chunk(chunk, pool, cache))
+
+            # Chunks are written in the order they were submitted, so the output matches a single
+            # process run. Only a few chunks per worker are kept in flight to keep memory usage flat
+            if len(pending) >= jobs * 2:
+                out_file, chunks_written = self._next_output(out_file, outputs, chunks_written, chunks_per_shard)
+                self._write_chunk(out_file, pending.popleft(), cache)
+
+        while pending:
+            out_file, chunks_written = self._next_output(out_file, outputs, chunks_written, chunks_per_shard)
+            self._write_chunk(out_file, pending.popleft(), cache)
+
+        # Any shards the pages didn't reach (the page count is only an estimate) are written empty
+        if out_file is None:
+            out_file = self._open_output(next(outputs))
+        self._close_output(out_file)
+        for path in outputs:
+            self._close_output(self._open_output(path))
+
+        return paths
+
+    def _open_output(self, path: str):
+        out_file = open(path, "w", encoding="utf-8")
+        out_file.write(DICTIONARY_HEADER)
+        return out_file
+
+    def _close_output(self, out_file):
+        out_file.write(DICTIONARY_FOOTER)
+        out_file.close()
+
+    def _next_output(self, out_file, outputs: Iterator[str], chunks_written: int, chunks_per_shard: float):
+        '''
+        The file the next chunk goes in, moving on to the next shard once this one is full (the last shard takes
+        whatever is left over)
+        '''
+        if out_file is not None and chunks_written >= chunks_per_shard:
+            path = next(outputs, None)
+            if path is not None:
+                self._close_output(out_file)
+                out_file = self._open_output(path)
+                chunks_written = 0
+
+        if out_file is None:
+            out_file = self._open_output(next(outputs))
+
+        return out_file, chunks_written + 1
+
+    def _write_chunk(self, out_file, pending, cache: Optional[FragmentCache]):
+        # Waiting on worker processes counts as rendering, as that's what they're doing
+        with phase("template render"):
+            fragments = self._finish_chunk(*pending, cache)
+        with phase("xml serialise"):
+            out_file.write(fragments)
+
+    def _submit_chunk(self, chunk: List[Entry], pool, cache: Optional[FragmentCache]):
+        digests = [None] * len(chunk)
+        fragments = [None] * len(chunk)
+
+        if cache:
+            digests = [page.digest() for page in chunk]
+            fragments = [cache.lookup(page.page_id, digest) for page, digest in zip(chunk, digests)]
+
+        # Only pages which weren't found in the cache need rendering
+        missing = [page for page, fragment in zip(chunk, fragments) if fragment is None]
+
+        if pool is None:
+            rendered = [*map(self.generate_entry, missing)]
+        else:
+            rendered = pool.apply_async(generate_chunk, (missing,))
+
+        return chunk, digests, fragments, rendered
 
-        # Create the page body using Jinja2
-        entry_html = self.templates[type(page)].render(entry=page)
+    def _finish_chunk(self, chunk: List[Entry], digests: List[Optional[str]], fragments: List[Optional[str]], rendered, cache: Optional[FragmentCache]) -> str:
+        rendered = iter(rendered if isinstance(rendered, list) else rendered.get())
 
-        # Append all page body elements onto the entry XML node
-        for element in ElementTree.fromstring(entry_html):
-            entry_node.append(element)
+        for index, page in enumerate(chunk):
+            if fragments[index] is None:
+                fragments[index] = next(rendered)
+            if cache:
+                cache.store(page.page_id, digests[index], fragments[index])
 
-    def write(self, output_location: str):
-        tree = ElementTree.ElementTree(self.root)
-        tree.write(output_location, "UTF-8", True)
+        return "".join(fragments)
@@ -0,0 +1,212 @@
+'''
+A compact binary form of the dictionary, built by dictionary_creator.py with --binary, which is memory-mapped and
+searched in place so loading it takes no time at all and processes reading the same file share the page cache.
+
+All integers are little endian. The file is laid out as:
+
+Header     HEADER: magic, version, then the (offset, count) of each section below
+Strings    UTF-8 keys and records, referenced by (offset, length) and not terminated
+Records    RECORD per page: (offset, length) of the page as JSON in the strings
+Pages      KEY per page: (offset, length) of the page id in the strings and the index of its record, sorted by page id
+Keys       One array of KEY per kind in KEY_KINDS: (offset, length) of the key in the strings and the index of the
+           record it finds, sorted by the UTF-8 key bytes (the same order as the code points)
+
+Only the records that are returned are decoded. Usage:
+
+python3 binary_dictionary.py dictionary.bin 你好
+python3 binary_dictionary.py dictionary.bin nei --prefix --kind toneless
+'''
+
+from typing import Dict, Iterable, Iterator, List, Optional
+from datatypes import *
+from lookup_index import KEY_KINDS, page_content, page_keys, query_key
+
+import argparse
+import struct
+import mmap
+import json
+import time
+import sys
+
+
+MAGIC = b"CDIC"
+# Bumped whenever the layout or the keys change, files from other versions would give wrong answers
+VERSION = 3
+
+HEADER = struct.Struct("<4sI" + "QQ" * (3 + len(KEY_KINDS)))
+RECORD = struct.Struct("<II")
+KEY = struct.Struct("<III")
+
+
+class BinaryDictionaryWriter:
+    '''
+    Writes the strings out as pages arrive, keeping only the keys and record positions until the pages are finished
+    '''
+    def __init__(self, path: str):
+        self.out_file = open(path, "wb")
+        # The header is written last, once the sections have been placed
+        self.out_file.write(bytes(HEADER.size))
+
+        self.strings_length = 0
+        self.string_offsets: Dict[bytes, int] = {}
+        self.records: List[tuple] = []
+        self.pages: List[tuple] = []
+        self.keys: Dict[str, List[tuple]] = {kind: [] for kind in KEY_KINDS}
+
+    def add_string(self, value: bytes) -> int:
+        offset = self.strings_length
+        self.out_file.write(value)
+        self.strings_length += len(value)
+        return offset
+
+    def add(self, page: Entry):
+        content = {"page_id": page.page_id, "language": page.language, **page_content(page)}
+        record = json.dumps(content, ensure_ascii=False).encode("utf-8")
+        record_index = len(self.records)
+        self.records.append((self.add_string(record), len(record)))
+
+        page_id = page.page_id.encode("utf-8")
+        self.pages.append((page_id, self.add_string(page_id), record_index))
+
+        for key, kind in page_keys(page):
+            key = key.encode("utf-8")
+            # Keys shared by several pages (readings mostly) are only stored once
+            offset = self.string_offsets.get(key)
+            if offset is None:
+                offset = self.string_offsets[key] = self.add_string(key)
+            self.keys[kind].append((key, offset, record_index))
+
+    def index_pages(self, pages: Iterable[Entry]) -> Iterator[Entry]:
+        # Adds pages to the file as they pass through on their way to the dictionary writer
+        for page in pages:
+            self.add(page)
+            yield page
+
+    def close(self):
+        sections = [(HEADER.size, self.strings_length)]
+
+        sections.append((self.out_file.tell(), len(self.records)))
+        for offset, length in self.records:
+            self.out_file.write(RECORD.pack(offset, length))
+
+        # Page ids are written the same way as keys, so they're searched the same way
+        for keys in [self.pages, *(self.keys[kind] for kind in KEY_KINDS)]:
+            keys = sorted(keys)
+            sections.append((self.out_file.tell(), len(keys)))
+            self.out_file.write(b"".join(KEY.pack(offset, len(key), record) for key, offset, record in keys))
+
+        self.out_file.seek(0)
+        self.out_file.write(HEADER.pack(MAGIC, VERSION, *(value for section in sections for value in section)))
+        self.out_file.close()
+
+
+class BinaryDictionary:
+    def __init__(self, path: str):
+        with open(path, "rb") as in_file:
+            self.map = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, *sections = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} isn't a version {VERSION} binary dictionary")
+
+        self.strings = sections[0]
+        self.records = sections[2]
+        self.record_count = sections[3]
+        self.page_array = (sections[4], sections[5])
+        self.key_arrays = {kind: (sections[6 + 2 * index], sections[7 + 2 * index]) for index, kind in enumerate(KEY_KINDS)}
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self.strings + offset
+        return self.map[start:start + length]
+
+    def _key(self, array_offset: int, index: int):
+        offset, length, record = KEY.unpack_from(self.map, array_offset + index * KEY.size)
+        return self._string(offset, length), record
+
+    def _lower_bound(self, array_offset: int, count: int, key: bytes) -> int:
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(array_offset, middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _matches(self, kind: str, key: bytes, prefix: bool) -> Iterator[int]:
+        array_offset, count = self.key_arrays[kind]
+        for index in range(self._lower_bound(array_offset, count, key), count):
+            candidate, record = self._key(array_offset, index)
+            if candidate != key and not (prefix and candidate.startswith(key)):
+                return
+            yield record
+
+    def record(self, index: int) -> Dict:
+        offset, length = RECORD.unpack_from(self.map, self.records + index * RECORD.size)
+        return json.loads(self._string(offset, length))
+
+    def keys(self, kind: str) -> Iterator[str]:
+        # Every key of a kind, in sorted order
+        array_offset, count = self.key_arrays[kind]
+        for index in range(count):
+            yield self._key(array_offset, index)[0].decode("utf-8")
+
+    def find_page(self, page_id: str) -> Optional[int]:
+        # The record index of the page with this id, if there is one
+        array_offset, count = self.page_array
+        key = page_id.encode("utf-8")
+        index = self._lower_bound(array_offset, count, key)
+        if index < count:
+            candidate, record = self._key(array_offset, index)
+            if candidate == key:
+                return record
+        return None
+
+    def _search(self, key: str, kind: Optional[str], limit: int, prefix: bool) -> List[Dict]:
+        key = query_key(key, kind).encode("utf-8")
+
+        found = []
+        for search_kind in [kind] if kind else KEY_KINDS:
+            for record in self._matches(search_kind, key, prefix):
+                if record not in found:
+                    found.append(record)
+                if len(found) >= limit:
+                    return [self.record(record) for record in found]
+
+        return [self.record(record) for record in found]
+
+    def exact(self, key: str, kind: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        return self._search(key, kind, limit, False)
+
+    def prefix(self, key: str, kind: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        return self._search(key, kind, limit, True)
+
+    def close(self):
+        self.map.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dictionary", type=str, help="binary dictionary built by dictionary_creator.py --binary")
+    parser.add_argument("query", type=str)
+    parser.add_argument("--prefix", action="store_true", help="find keys starting with the query")
+    parser.add_argument("--kind", choices=KEY_KINDS, help="only match keys of this kind")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dictionary = BinaryDictionary(args.dictionary)
+    loaded = time.perf_counter()
+    search = dictionary.prefix if args.prefix else dictionary.exact
+    results = search(args.query, args.kind, args.limit)
+    elapsed = time.perf_counter() - loaded
+
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    print(f"Loaded in {(loaded - start) * 1000:.3f}ms, {len(results)} results in {elapsed * 1000:.3f}ms", file=sys.stderr)
+
+    dictionary.close()
+
+
+if __name__ == "__main__":
+    main()
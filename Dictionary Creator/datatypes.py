@@ -1,37 +1,129 @@
-from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence
+
+import hashlib
+import sys
+
+
+def intern(value: Optional[str]) -> Optional[str]:
+    # Readings, meanings and qualifiers repeat across many entries, interning keeps a single copy of each
+    return None if value is None else sys.intern(value)
+
+
+# How each type of cross reference is introduced on a page
+REFERENCE_DESCRIPTIONS = {
+    "classifier": "Classifier",
+    "measure word": "Measure word",
+    "pronunciation": "Also pronounced",
+}
+
+
+def dictionary_link(page_id: str) -> str:
+    # Opens the entry with this id in Dictionary.app
+    return "x-dictionary:r:" + page_id
+
+
+class CrossReference:
+    __slots__ = ("type", "page_id", "label")
+
+    def __init__(self, type: str, page_id: str, label: str):
+        self.type = intern(type)
+        self.page_id = page_id
+        self.label = label
+
+    @property
+    def description(self) -> str:
+        return REFERENCE_DESCRIPTIONS.get(self.type, self.type.capitalize())
+
+    @property
+    def link(self) -> str:
+        return dictionary_link(self.page_id)
+
+    def content(self) -> tuple:
+        return (self.type, self.page_id, self.label)
+
 
-@dataclass
 class EnglishTranslation:
-    translation: str
-    qualifier: Optional[str] = None
-    alternate_form: Optional[str] = None
-    literal_meaning: Optional[str] = None
-    transliteration: Optional[str] = None
+    __slots__ = ("translation", "qualifier", "alternate_form", "literal_meaning", "transliteration", "link")
+
+    def __init__(self, translation: str, qualifier: Optional[str] = None, alternate_form: Optional[str] = None, literal_meaning: Optional[str] = None, transliteration: Optional[str] = None):
+        self.translation = translation
+        self.qualifier = intern(qualifier)
+        self.alternate_form = alternate_form
+        self.literal_meaning = literal_meaning
+        self.transliteration = intern(transliteration)
+        # Link to the Cantonese entry for the translation, if there is one, set once every entry is known
+        self.link: Optional[str] = None
+
+    def content(self) -> tuple:
+        return (self.translation, self.qualifier, self.alternate_form, self.literal_meaning, self.transliteration, self.link)
 
 
-@dataclass
 class EnglishTranslationSense:
-    meaning: str
-    translations: List[EnglishTranslation]
+    __slots__ = ("meaning", "translations")
+
+    def __init__(self, meaning: str, translations: List[EnglishTranslation]):
+        self.meaning = intern(meaning)
+        self.translations = translations
+
+    def content(self) -> tuple:
+        return (self.meaning, tuple(translation.content() for translation in self.translations))
 
 
 class Entry:
-    def __init__(self, page_title: str, language: str, entry_type: str):
+    __slots__ = ("page_title",)
+
+    # Make up the page id along with the page key, set by each type of entry
+    language = ""
+    entry_type = ""
+
+    def __init__(self, page_title: str):
         self.page_title: str = page_title
-        self.page_id: str = "{}_{}_{}".format(language, entry_type, page_title)
+
+    @property
+    def page_key(self) -> str:
+        return self.page_title
+
+    @property
+    def page_id(self) -> str:
+        # Formatted on request rather than stored, as it's only needed when the page is written
+        return self.page_id_of(self.page_key)
+
+    @classmethod
+    def page_id_of(cls, page_key) -> str:
+        # The id of the page of this type with the given key, for linking to pages which haven't been created
+        return "{}_{}_{}".format(cls.language, cls.entry_type, page_key)
+
+    def content(self) -> tuple:
+        return (self.page_id, self.page_title)
+
+    def digest(self) -> str:
+        # Identifies everything that ends up on the rendered page, used to tell if a page needs re-rendering
+        return hashlib.sha1(repr(self.content()).encode("utf-8")).hexdigest()
 
 
 class CantoneseEntry(Entry):
+    __slots__ = ("id", "traditional", "simplified", "readings", "definitions", "references")
+
+    language = "yue"
+    entry_type = "dictionary"
+
     def __init__(self, id: int, traditional: str, simplified: str):
-        super().__init__(str(id), "yue", "dictionary")
-        # Manually set the page title in parent, as otherwise it's set to the id
-        self.page_title = traditional
-        
+        # The page title is the traditional form, the page is identified by the id instead
+        super().__init__(traditional)
+
+        self.id = id
         self.traditional = traditional
         self.simplified = simplified
+        # Lists rather than ordered sets, an entry only has a few of each so checking for duplicates is cheap and a
+        # list takes far less memory than a dict
         self.readings: List[str] = []
         self.definitions: List[str] = []
+        # Hardly any entries have references, so the list is only made for those that do
+        self.references: Sequence[CrossReference] = ()
+
+    @property
+    def page_key(self) -> str:
+        return str(self.id)
 
     def add_definition(self, definition: str):
         # Needed as SQLite "helpfully" makes numeric definitions int type regardless of schema
@@ -42,23 +134,46 @@ class CantoneseEntry(Entry):
     def add_reading(self, reading: str):
         reading = reading.strip()
         if reading != "" and reading not in self.readings:
-            self.readings.append(reading)
+            self.readings.append(intern(reading))
+
+    def add_reference(self, type: str, target_id: int, label: str):
+        # Targets are other Cantonese entries, identified the same way as this one
+        self.add_cross_reference(CrossReference(type, self.page_id_of(target_id), label))
+
+    def add_cross_reference(self, reference: CrossReference):
+        if not self.references:
+            self.references = []
+        self.references.append(reference)
 
     def is_worth_adding(self) -> bool:
         return len(self.readings) > 0 and len(self.definitions) > 0
 
+    def content(self) -> tuple:
+        return (self.page_id, self.traditional, self.simplified, tuple(self.readings), tuple(self.definitions), tuple(reference.content() for reference in self.references))
+
 
 class EnglishEntry(Entry):
+    __slots__ = ("_senses",)
+
+    language = "en"
+    entry_type = "dictionary"
+
     def __init__(self, root_word: str):
-        super().__init__(root_word, "en", "dictionary")
-        self.translations: List[EnglishTranslationSense] = []
-        self._translation_guide: Dict[str, EnglishTranslationSense] = dict()
-
-    def add_translation(self, meaning: str, translation: str, alternate: Optional[str], literal: Optional[str], qualifier: Optional[str], transliteration: Optional[str]):
-        if meaning not in self._translation_guide:
-            new_sense = EnglishTranslationSense(meaning, [])
-            self.translations.append(new_sense)
-            self._translation_guide[meaning] = new_sense
-        
-        new_translation = EnglishTranslation(translation, alternate, literal, qualifier, transliteration)
-        self._translation_guide[meaning].translations.append(new_translation)
\ No newline at end of file
+        super().__init__(root_word)
+        # Senses keyed by their meaning, in the order they were first added
+        self._senses: Dict[str, EnglishTranslationSense] = dict()
+
+    @property
+    def translations(self) -> List[EnglishTranslationSense]:
+        return [*self._senses.values()]
+
+    def add_translation(self, meaning: str, translation: str, alternate: Optional[str], literal: Optional[str], qualifier: Optional[str], transliteration: Optional[str], link: Optional[str] = None):
+        if meaning not in self._senses:
+            self._senses[meaning] = EnglishTranslationSense(meaning, [])
+
+        new_translation = EnglishTranslation(translation, qualifier, alternate, literal, transliteration)
+        new_translation.link = link
+        self._senses[meaning].translations.append(new_translation)
+
+    def content(self) -> tuple:
+        return (self.page_id, self.page_title, tuple(sense.content() for sense in self._senses.values()))
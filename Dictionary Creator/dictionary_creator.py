@@ -1,93 +1,272 @@
 import argparse
+import itertools
 import sqlite3
+import sys
+import os
 
-from dataclasses import dataclass
-from typing import List, Dict, Optional
+from operator import itemgetter
+from typing import Dict, Optional, Iterable, Iterator, Set, Tuple
 from datatypes import *
 from apple_dictionary_writer import AppleDictionaryWriter
+from fragment_cache import FragmentCache
+from lookup_index import LookupIndexWriter
+from binary_dictionary import BinaryDictionaryWriter
+from reverse_index import ReverseIndex, index_terms
 
+# Modules shared with the converters live in the Shared directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+
+from instrumentation import Progress, instrument_stage, timed
 
-def get_stats(pages):
-    entries = {
-        "english": 0,
-        "cantonese": 0,
-        "other": 0
-    }
 
+def count_pages(pages: Iterable[Entry], entries: Dict[str, int], progress: Progress) -> Iterator[Entry]:
+    # Counts the pages as they pass through on their way to the writer, as they're only iterated over once
     for entry in pages:
+        progress.update(pages=1)
         if isinstance(entry, CantoneseEntry):
             entries["cantonese"] += 1
         elif isinstance(entry, EnglishEntry):
             entries["english"] += 1
         else:
             entries["other"] += 1
+        yield entry
+
 
+def get_stats(entries: Dict[str, int]):
     print(f"Created:\n{entries['cantonese']} cantonese entries\n{entries['english']} english entries\n{entries['other']} other entries")
 
 
+def add_output_arguments(parser: argparse.ArgumentParser):
+    # Shared with pipeline.py, which writes the dictionary the same way
+    parser.add_argument("-o", type=str)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes used to render pages")
+    parser.add_argument("--incremental", action="store_true", help="reuse pages rendered by the previous build if unchanged")
+    parser.add_argument("--lookup", type=str, help="also build an indexed lookup store of the pages at this path")
+    parser.add_argument("--binary", type=str, help="also write a memory-mappable binary dictionary to this path")
+    parser.add_argument("--reverse-index", action="store_true", help="add the entries defined by each English word to its English page")
+    parser.add_argument("--minify", action="store_true", help="leave out the whitespace between tags, as xmllint --noblanks does")
+    parser.add_argument("--shards", type=int, default=1, help="split the output into this many documents, see shard_tools.py")
+    parser.add_argument("--jinja", action="store_true", help="render pages with Jinja2 rather than the pre-compiled templates")
+
+
 def get_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("database", type=str)
-    parser.add_argument("-o", type=str)
+    add_output_arguments(parser)
+    parser.add_argument("--profile", type=str, help="write cProfile statistics for the run to this path")
     return parser.parse_args()
 
 
-def create_cantonese_entries(database_path: str) -> List[CantoneseEntry]:
+def group_by_id(rows: Iterable[tuple]) -> Iterator[Tuple[int, list]]:
+    # Rows must be ordered by id, rows of a single value after the id are reduced to the value
+    for id, group in itertools.groupby(rows, key=itemgetter(0)):
+        yield id, [row[1] if len(row) == 2 else row[1:] for row in group]
+
+
+def index_page_ids(pages: Iterable[Entry], page_ids: Dict[str, str]) -> Iterator[Entry]:
+    # Records the page of each traditional and simplified form as the Cantonese pages pass through, for databases
+    # without the combiner's LinkTargets. The first page with a form is linked to, which is the one with the lowest
+    # id rather than the first in the sources
+    for page in pages:
+        if isinstance(page, CantoneseEntry):
+            page_ids.setdefault(page.traditional, page.page_id)
+            page_ids.setdefault(page.simplified, page.page_id)
+        yield page
+
+
+def link_translations(pages: Iterable[EnglishEntry], page_ids: Dict[str, str]) -> Iterator[EnglishEntry]:
+    # Links each translation to the Cantonese page for it, all of which have been created before the English pages.
+    # Translations from the reverse index already link to the entry they came from
+    for page in pages:
+        for sense in page.translations:
+            for translation in sense.translations:
+                page_id = page_ids.get(translation.translation)
+                if page_id is not None and translation.link is None:
+                    translation.link = dictionary_link(page_id)
+        yield page
+
+
+def read_link_targets(database_path: str) -> Optional[Dict[str, int]]:
+    # The entry the combiner picked for each form to link to, databases from before then have none
     db = sqlite3.connect(database_path)
-    cursor = db.cursor()
+    has_targets = db.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'LinkTargets'").fetchone()[0]
+    targets = dict(db.execute("SELECT form, target FROM LinkTargets")) if has_targets else None
+    db.close()
+    return targets
+
+
+def read_entry_rows(database_path: str) -> Iterator[tuple]:
+    '''
+    Yield each entry as (id, traditional, simplified, definitions, readings, references) as soon as it's complete, by
+    walking the entries, definitions, readings and references in id order together (a merge join), so only one entry
+    is held at a time
+    '''
+    db = sqlite3.connect(database_path)
+
+    entry_query = db.execute("SELECT id, traditional, simplified FROM Entries ORDER BY id")
+    # Ordering by rowid as well keeps definitions and readings in the order they were added
+    definitions = group_by_id(db.execute("SELECT id, definition FROM Definitions ORDER BY id, rowid"))
+    readings = group_by_id(db.execute("SELECT id, reading FROM Readings ORDER BY id, rowid"))
+    # References were resolved to the ids of their targets by the combiner, databases from before then have none
+    has_references = db.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'CrossReferences'").fetchone()[0]
+    references = group_by_id(db.execute("SELECT id, type, target, label FROM CrossReferences ORDER BY id, rowid") if has_references else [])
 
-    pages = {}
+    next_definitions = next(definitions, None)
+    next_readings = next(readings, None)
+    next_references = next(references, None)
 
-    entry_query = cursor.execute("SELECT id, traditional, simplified FROM Entries")
-    for id, traditional, simplified in entry_query.fetchall():
-        pages[id] = CantoneseEntry(id, traditional, simplified)
+    for id, traditional, simplified in entry_query:
+        # Skip over any rows which reference entries that don't exist
+        while next_definitions is not None and next_definitions[0] < id:
+            next_definitions = next(definitions, None)
+        while next_readings is not None and next_readings[0] < id:
+            next_readings = next(readings, None)
+        while next_references is not None and next_references[0] < id:
+            next_references = next(references, None)
 
-    definition_query = cursor.execute("SELECT id, definition FROM Definitions")
-    for id, definition in definition_query.fetchall():
-        pages[id].add_definition(definition)
+        yield (
+            id,
+            traditional,
+            simplified,
+            next_definitions[1] if next_definitions is not None and next_definitions[0] == id else [],
+            next_readings[1] if next_readings is not None and next_readings[0] == id else [],
+            next_references[1] if next_references is not None and next_references[0] == id else [],
+        )
 
+    db.close()
 
-    reading_query = cursor.execute("SELECT id, reading FROM Readings")
-    for id, reading in reading_query.fetchall():
-        pages[id].add_reading(reading)
-    
-    pages = [*filter(lambda x: x.is_worth_adding(), pages.values())]
 
-    return pages
+def cantonese_pages_from_rows(rows: Iterable[tuple]) -> Iterator[CantoneseEntry]:
+    # Rows are laid out as read_entry_rows() gives them, which is also how the combiner numbers its entries
+    for id, traditional, simplified, definitions, readings, references in rows:
+        page = CantoneseEntry(id, traditional, simplified)
+        for definition in definitions:
+            page.add_definition(definition)
+        for reading in readings:
+            page.add_reading(reading)
+        for type, target, label in references:
+            page.add_reference(type, target, label)
 
+        if page.is_worth_adding():
+            yield page
 
-def create_english_pages(database_path: str) -> List[EnglishEntry]:
+
+def create_cantonese_entries(database_path: str) -> Iterator[CantoneseEntry]:
+    return cantonese_pages_from_rows(read_entry_rows(database_path))
+
+
+def english_pages_from_rows(rows: Iterable[tuple]) -> Iterator[EnglishEntry]:
+    '''
+    Group (english, meaning, translation, transliteration, alternate, literal, qualifier) rows, which must be ordered
+    by english, into pages
+    '''
+    for en, group in itertools.groupby(rows, key=itemgetter(0)):
+        page = EnglishEntry(en)
+        for _, mean, trans, translit, alt, lit, qual in group:
+            page.add_translation(mean, trans, alt, lit, qual, translit)
+        yield page
+
+
+def create_english_pages(database_path: str) -> Iterator[EnglishEntry]:
     db = sqlite3.connect(database_path)
-    cursor = db.cursor()
 
-    result: Dict[str, EnglishEntry] = dict()
+    query = db.execute("""
+    SELECT english, meaning, translation, transliteration, alternate, literal, qualifier
+    FROM EnglishTranslations
+    ORDER BY english, rowid
+    """)
+    yield from english_pages_from_rows(query)
 
-    query = cursor.execute("SELECT * FROM EnglishTranslations")
+    db.close()
 
-    for en, mean, trans, translit, alt, lit, qual in query.fetchall():
-        if en not in result:
-            result[en] = EnglishEntry(en)
-        
-        result[en].add_translation(mean, trans, alt, lit, qual, translit)
 
-    return list(result.values())
+def count_reverse_index_pages(definitions: Iterable[str], english_words: Set[str]) -> int:
+    # The English pages only the reverse index creates, for the terms no translation has a page for already
+    return len(index_terms(definitions) - english_words)
 
 
-def main():
-    args = get_arguments()
+def count_expected_pages(database_path: str, reverse_index: bool = False) -> int:
+    # An upper bound, entries without readings or definitions are left out later
+    db = sqlite3.connect(database_path)
+    count, = db.execute("SELECT (SELECT count(*) FROM Entries) + (SELECT count(DISTINCT english) FROM EnglishTranslations)").fetchone()
+
+    if reverse_index:
+        english_words = {english for english, in db.execute("SELECT DISTINCT english FROM EnglishTranslations")}
+        # Only entries with readings make it into the dictionary, and so into the reverse index
+        definitions = db.execute("SELECT definition FROM Definitions WHERE id IN (SELECT id FROM Readings)")
+        count += count_reverse_index_pages((str(definition) for definition, in definitions), english_words)
+
+    db.close()
+    return count
+
+
+def write_dictionary(cantonese_pages: Iterable[CantoneseEntry], english_pages: Iterable[EnglishEntry], expected_pages: int, args: argparse.Namespace, link_targets: Optional[Dict[str, int]] = None):
+    '''
+    Write the pages, and anything else the output arguments (see add_output_arguments()) ask for. Translations link to
+    the entries given by link_targets (see the combiner's link_targets()), or the first page with the characters
+    without them
+    '''
+    entries = {
+        "english": 0,
+        "cantonese": 0,
+        "other": 0
+    }
+
+    progress = Progress("pages", expected_pages, "pages")
+
+    # Translations on the English pages link to the Cantonese page for them, found by the characters
+    if link_targets is not None:
+        page_ids = {form: CantoneseEntry.page_id_of(target) for form, target in link_targets.items()}
+    else:
+        page_ids: Dict[str, str] = {}
+        cantonese_pages = index_page_ids(cantonese_pages, page_ids)
 
-    # This will contain all the pages for the dictionary as they are added
-    pages: Dict[str, Entry] = dict()
+    # The definitions are indexed as the Cantonese pages are written, which all comes before the English pages
+    if args.reverse_index:
+        reverse_index = ReverseIndex()
+        cantonese_pages = reverse_index.index_pages(cantonese_pages)
+        english_pages = reverse_index.merge(english_pages)
 
-    pages = set([
-        *create_cantonese_entries(args.database),
-        *create_english_pages(args.database)
-    ])
+    english_pages = link_translations(english_pages, page_ids)
 
-    dictionary = AppleDictionaryWriter(pages)
-    dictionary.write(args.o)
+    # Pages are created one at a time as the writer asks for them
+    pages = count_pages(timed(itertools.chain(cantonese_pages, english_pages), "database read"), entries, progress)
+
+    lookup = LookupIndexWriter(args.lookup) if args.lookup else None
+    if lookup:
+        pages = lookup.index_pages(pages)
+
+    binary = BinaryDictionaryWriter(args.binary) if args.binary else None
+    if binary:
+        pages = binary.index_pages(pages)
+
+    dictionary = AppleDictionaryWriter(pages, not args.jinja, args.minify)
+
+    # The cache of rendered pages is kept next to the output so the next build can reuse them
+    cache = FragmentCache(args.o + ".cache", dictionary.signature()) if args.incremental else None
+
+    dictionary.write(args.o, args.jobs, cache, args.shards, expected_pages)
+    progress.finish()
+
+    if lookup:
+        lookup.close()
+
+    if binary:
+        binary.close()
+
+    if cache:
+        cache.close()
+        print(f"Reused {cache.hits} unchanged entries, rendered {cache.misses} new or changed entries")
+
+    get_stats(entries)
+
+
+def main():
+    args = get_arguments()
 
-    get_stats(pages)
+    with instrument_stage("creator", args.profile):
+        expected_pages = count_expected_pages(args.database, args.reverse_index)
+        write_dictionary(create_cantonese_entries(args.database), create_english_pages(args.database), expected_pages, args, read_link_targets(args.database))
 
 
 if __name__ == "__main__":
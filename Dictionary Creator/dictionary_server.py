@@ -0,0 +1,246 @@
+'''
+Serves the dictionary over HTTP, for tools that can't use Dictionary.app, from the binary dictionary built by
+dictionary_creator.py with --binary. The dictionary is memory-mapped once at start up and queries are answered from it
+in place, as JSON or as HTML rendered with the same templates as the dictionary pages:
+
+GET /lookup?q=你好                                  pages found by the query, as JSON
+GET /lookup?q=nei&kind=toneless&prefix=1&limit=10   kind is one of KEY_KINDS, all kinds are searched without it
+GET /lookup?q=dog&format=html                       the pages found, rendered
+GET /page/yue_dictionary_123                        a single page by its id, rendered (or JSON with format=json)
+GET /stats                                          requests answered and render cache usage, as JSON
+
+Rendered pages are kept in an LRU cache. Requests are handled by asyncio on a single thread, lookups and rendering are
+quick enough not to hold up other connections for long. Usage:
+
+python3 dictionary_server.py dictionary.bin --port 8080
+
+See Benchmarks/server_benchmark.py for a load test.
+'''
+
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+from datatypes import *
+from apple_dictionary_writer import ASSETS_DIRECTORY, AppleDictionaryWriter
+from binary_dictionary import BinaryDictionary
+from lookup_index import KEY_KINDS, page_from_content
+
+import functools
+import argparse
+import asyncio
+import json
+import time
+import os
+
+
+# Most pages a single lookup can return
+MAX_LIMIT = 200
+
+DEFAULT_LIMIT = 20
+
+# Rendered pages kept in the cache
+DEFAULT_CACHE_SIZE = 8192
+
+# Longest request line or header accepted, anything longer is answered with an error
+MAX_LINE_LENGTH = 8192
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+HTML_DOCUMENT = (
+    "<!DOCTYPE html>\n"
+    "<html><head><meta charset=\"utf-8\"><title>{}</title><link rel=\"stylesheet\" href=\"/style.css\"></head>"
+    "<body>{}</body></html>"
+)
+
+# Links between pages open Dictionary.app, they're pointed at this server instead
+DICTIONARY_LINK = 'href="' + dictionary_link("")
+PAGE_LINK = 'href="/page/'
+
+# (status, content type, body)
+Response = Tuple[int, str, bytes]
+
+
+def json_response(value, status: int = 200) -> Response:
+    return status, "application/json; charset=utf-8", json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def error_response(status: int, message: str) -> Response:
+    return json_response({"error": message}, status)
+
+
+def html_response(title: str, fragments: List[str]) -> Response:
+    return 200, "text/html; charset=utf-8", HTML_DOCUMENT.format(escape(title), "".join(fragments)).encode("utf-8")
+
+
+class DictionaryServer:
+    def __init__(self, dictionary: BinaryDictionary, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.dictionary = dictionary
+        # Pages are only rendered, never written, so the writer is given none
+        self.writer = AppleDictionaryWriter([])
+        self.render = functools.lru_cache(maxsize=cache_size)(self._render)
+        self.requests = 0
+        self.started = time.time()
+
+        with open(os.path.join(ASSETS_DIRECTORY, "style.css"), "rb") as style_file:
+            self.style = style_file.read()
+
+    def _render(self, record: int) -> str:
+        page = page_from_content(self.dictionary.record(record))
+        markup = self.writer.renderers[type(page)](page)
+        # The body of the page, without the enclosing <body> tags, so several pages can be put together
+        return markup[markup.index(">") + 1:markup.rindex("<")].strip().replace(DICTIONARY_LINK, PAGE_LINK)
+
+    def lookup(self, query: Dict[str, List[str]]) -> Response:
+        text = query.get("q", [""])[0]
+        kind = query.get("kind", [None])[0]
+        prefix = query.get("prefix", ["0"])[0].lower() in ("1", "true", "yes")
+        output_format = query.get("format", ["json"])[0]
+
+        if not text.strip():
+            return error_response(400, "q must be given")
+        if kind is not None and kind not in KEY_KINDS:
+            return error_response(400, f"kind must be one of {', '.join(KEY_KINDS)}")
+        if output_format not in ("json", "html"):
+            return error_response(400, "format must be json or html")
+        try:
+            limit = max(1, min(int(query.get("limit", [DEFAULT_LIMIT])[0]), MAX_LIMIT))
+        except ValueError:
+            return error_response(400, "limit must be a number")
+
+        search = self.dictionary.prefix if prefix else self.dictionary.exact
+        results = search(text, kind, limit)
+
+        if output_format == "html":
+            return html_response(text, [self.render(self.dictionary.find_page(result["page_id"])) for result in results])
+        return json_response(results)
+
+    def page(self, page_id: str, query: Dict[str, List[str]]) -> Response:
+        # Page ids are searched in the dictionary like any other key, nothing is loaded up front
+        record = self.dictionary.find_page(page_id)
+        if record is None:
+            return error_response(404, f"no page {page_id}")
+
+        if query.get("format", ["html"])[0] == "json":
+            return json_response(self.dictionary.record(record))
+        return html_response(page_id, [self.render(record)])
+
+    def stats(self) -> Response:
+        cache = self.render.cache_info()
+        return json_response({
+            "requests": self.requests,
+            "pages": self.dictionary.record_count,
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "render_cache": {"hits": cache.hits, "misses": cache.misses, "size": cache.currsize, "max_size": cache.maxsize},
+        })
+
+    def respond(self, method: str, target: str) -> Response:
+        if method not in ("GET", "HEAD"):
+            return error_response(405, f"{method} isn't supported")
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if url.path == "/lookup":
+            return self.lookup(query)
+        if url.path.startswith("/page/"):
+            return self.page(unquote(url.path[len("/page/"):]), query)
+        if url.path == "/stats":
+            return self.stats()
+        if url.path == "/style.css":
+            return 200, "text/css; charset=utf-8", self.style
+        return error_response(404, f"nothing at {url.path}")
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str]]]:
+        '''
+        The method, target, version and headers of the next request on a connection, or None once it's closed
+        '''
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        # Targets should be percent-encoded, but some clients send UTF-8 as it is
+        parts = request_line.decode("utf-8", "replace").split()
+        if len(parts) != 3:
+            raise ValueError("malformed request line")
+
+        # Only GET and HEAD are answered, but a body has to be read past to get to the next request
+        length = int(headers.get("content-length", 0))
+        if length:
+            await reader.readexactly(length)
+
+        return parts[0], parts[1], parts[2], headers
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Connections are kept open between requests unless the client asks otherwise (or only speaks HTTP/1.0)
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except ValueError:
+                    status, content_type, body = error_response(400, "malformed request")
+                    request, keep_alive = None, False
+                else:
+                    if request is None:
+                        break
+                    method, target, version, headers = request
+                    status, content_type, body = self.respond(method, target)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                    self.requests += 1
+
+                head = (
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n"
+                )
+                writer.write(head.encode("latin-1"))
+                if request is None or request[0] != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_LINE_LENGTH)
+        print(f"Serving {self.dictionary.record_count} pages on http://{host}:{port}/", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dictionary", type=str, help="binary dictionary built by dictionary_creator.py --binary")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="number of rendered pages kept")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dictionary = BinaryDictionary(args.dictionary)
+    server = DictionaryServer(dictionary, args.cache_size)
+    print(f"Loaded {args.dictionary} in {time.perf_counter() - start:.2f}s")
+
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dictionary.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+'''
+Renders the entry pages without going through the Jinja2 runtime, producing exactly the same markup.
+
+Each template is split once into the literal markup between its tags, so the boilerplate (the <body> tag, the inline
+script, section headers) becomes pre-built constant strings, and a builder function specialised for that template
+joins them with the escaped entry values. The builders rely on the tags of the templates being the ones listed
+below, so they're only used if the tags match and the output matches Jinja2 for a set of sample entries, otherwise
+the Jinja2 templates are used as before.
+
+Bump FORMAT_VERSION in apple_dictionary_writer.py whenever the builders change, so pages cached by --incremental
+builds are rendered again.
+'''
+
+from typing import Callable, Dict, List, Optional
+from jinja2 import Template
+from datatypes import *
+
+import re
+
+
+# Jinja2 expressions and statements
+TAG_PATTERN = re.compile(r"{{.*?}}|{%.*?%}", re.DOTALL)
+
+# The tags each builder below expects to find in its template, in order, with whitespace collapsed
+CANTONESE_TAGS = [
+    "entry.traditional",
+    "if entry.traditional != entry.simplified",
+    "entry.simplified",
+    "endif",
+    "if entry.readings | count == 1",
+    "entry.readings[0]",
+    "endif",
+    "for definition in entry.definitions",
+    "loop.index",
+    "definition",
+    "endfor",
+    "if entry.references",
+    "for reference in entry.references",
+    "reference.description",
+    "reference.link",
+    "reference.label",
+    "endfor",
+    "endif",
+]
+
+ENGLISH_TAGS = [
+    "entry.page_title",
+    "for definition in entry.translations",
+    "loop.index",
+    "definition.meaning",
+    "for translation in definition.translations",
+    "if translation.link",
+    "translation.link",
+    "translation.translation",
+    "else",
+    "translation.translation",
+    "endif",
+    "if translation.transliteration",
+    "translation.transliteration",
+    "endif",
+    "if not loop.last",
+    "endif",
+    "endfor",
+    "endfor",
+]
+
+
+def escape(value) -> str:
+    # The same characters and replacements as Jinja2's autoescaping (markupsafe)
+    return (
+        str(value)
+        .replace("&", "&amp;")
+        .replace(">", "&gt;")
+        .replace("<", "&lt;")
+        .replace("'", "&#39;")
+        .replace("\"", "&#34;")
+    )
+
+
+def split_template(source: str, expected_tags: List[str]) -> Optional[List[str]]:
+    '''
+    Split a template into the literal markup around each tag, or None if its tags aren't the ones expected
+    '''
+    # Jinja2 drops a single trailing newline from templates
+    if source.endswith("\n"):
+        source = source[:-1]
+
+    # str.split() also collapses other unicode whitespace, such as the ideographic space in cantonese_entry.html
+    tags = [" ".join(tag[2:-2].split()) for tag in TAG_PATTERN.findall(source)]
+    if tags != expected_tags:
+        return None
+    return TAG_PATTERN.split(source)
+
+
+def compile_cantonese(literals: List[str]) -> Callable[[CantoneseEntry], str]:
+    (header, after_title, simplified_start, simplified_end, after_simplified, reading_start, reading_end,
+     after_reading, definition_start, after_number, after_definition, after_definitions, references_start,
+     reference_start, after_description, after_link, after_label, references_end, footer) = literals
+
+    def render(entry: CantoneseEntry) -> str:
+        parts = [header, escape(entry.traditional), after_title]
+
+        if entry.traditional != entry.simplified:
+            parts += [simplified_start, escape(entry.simplified), simplified_end]
+        parts.append(after_simplified)
+
+        readings = entry.readings
+        if len(readings) == 1:
+            parts += [reading_start, escape(readings[0]), reading_end]
+        parts.append(after_reading)
+
+        for index, definition in enumerate(entry.definitions, 1):
+            parts += [definition_start, str(index), after_number, escape(definition), after_definition]
+        parts.append(after_definitions)
+
+        if entry.references:
+            parts.append(references_start)
+            for reference in entry.references:
+                parts += [reference_start, escape(reference.description), after_description, escape(reference.link),
+                          after_link, escape(reference.label), after_label]
+            parts.append(references_end)
+        parts.append(footer)
+
+        return "".join(parts)
+
+    return render
+
+
+def compile_english(literals: List[str]) -> Callable[[EnglishEntry], str]:
+    (header, after_title, sense_start, after_number, after_meaning, translation_start, link_start, link_middle,
+     link_end, plain_start, plain_end, after_translation, transliteration_start, transliteration_end,
+     after_transliteration, separator, translation_end, sense_end, footer) = literals
+
+    def render(entry: EnglishEntry) -> str:
+        parts = [header, escape(entry.page_title), after_title]
+
+        for index, sense in enumerate(entry.translations, 1):
+            parts += [sense_start, str(index), after_number, escape(sense.meaning), after_meaning]
+
+            last = len(sense.translations) - 1
+            for position, translation in enumerate(sense.translations):
+                parts.append(translation_start)
+                if translation.link:
+                    parts += [link_start, escape(translation.link), link_middle, escape(translation.translation), link_end]
+                else:
+                    parts += [plain_start, escape(translation.translation), plain_end]
+                parts.append(after_translation)
+                if translation.transliteration:
+                    parts += [transliteration_start, escape(translation.transliteration), transliteration_end]
+                parts.append(after_transliteration)
+                if position != last:
+                    parts.append(separator)
+                parts.append(translation_end)
+
+            parts.append(sense_end)
+        parts.append(footer)
+
+        return "".join(parts)
+
+    return render
+
+
+def sample_entries() -> List[Entry]:
+    '''
+    Entries covering every branch of both templates, used to check the builders match Jinja2
+    '''
+    single = CantoneseEntry(1, "你好", "你好")
+    single.add_reading("nei5 hou2")
+    single.add_definition("hello")
+    single.add_definition("<how> are \"you\" & 'friends'")
+
+    variants = CantoneseEntry(2, "國家", "国家")
+    variants.add_reading("gwok3 gaa1")
+    variants.add_reading("gwok3 ga1")
+    variants.add_definition("country")
+    variants.add_reference("classifier", 1, "個")
+    variants.add_reference("measure word", 3, "<隻>")
+
+    empty = CantoneseEntry(3, "空", "空")
+
+    english = EnglishEntry("good & <bad>")
+    english.add_translation("of high quality", "好", None, None, None, "hou2")
+    english.add_translation("of high quality", "\"靚\"", "alt", "lit", "colloquial", None)
+    english.add_translation("", "正", None, None, None, "zeng3")
+    english.translations[0].translations[0].link = dictionary_link("yue_dictionary_1")
+
+    return [single, variants, empty, english, EnglishEntry("nothing")]
+
+
+def compile_templates(templates: Dict[type, Template]) -> Dict[type, Callable[[Entry], str]]:
+    '''
+    Build the specialised renderers for the given Jinja2 templates, falling back to the templates themselves for any
+    that can't be compiled or don't produce the same output
+    '''
+    compilers = {
+        CantoneseEntry: (CANTONESE_TAGS, compile_cantonese),
+        EnglishEntry: (ENGLISH_TAGS, compile_english),
+    }
+
+    renderers = {}
+    for entry_type, template in templates.items():
+        fallback = lambda page, template=template: template.render(entry=page)
+        renderers[entry_type] = fallback
+
+        with open(template.filename, encoding="utf-8") as template_file:
+            literals = split_template(template_file.read(), compilers[entry_type][0])
+        if literals is None:
+            print(f"{template.name} has changed, using Jinja2 to render it")
+            continue
+
+        render = compilers[entry_type][1](literals)
+        samples = [page for page in sample_entries() if isinstance(page, entry_type)]
+        if all(render(page) == fallback(page) for page in samples):
+            renderers[entry_type] = render
+        else:
+            print(f"Pre-compiled {template.name} doesn't match Jinja2, using Jinja2 to render it")
+
+    return renderers
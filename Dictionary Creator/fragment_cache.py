@@ -0,0 +1,70 @@
+import os
+import sqlite3
+
+from typing import Optional
+
+
+class FragmentCache:
+    '''
+    Keeps the rendered XML fragment of every page from the previous build, alongside a digest of the page
+    contents, so that pages which have not changed since then can be written without being rendered again.
+
+    Each build writes a fresh cache next to the old one and swaps it in on close, so pages which were removed
+    from the dictionary are dropped, and an interrupted build leaves the previous cache untouched.
+    '''
+
+    def __init__(self, path: str, signature: str):
+        self.path = path
+        self.signature = signature
+        self.hits = 0
+        self.misses = 0
+
+        self.previous: Optional[sqlite3.Connection] = None
+        if os.path.exists(path):
+            self.previous = sqlite3.connect(path)
+            # Fragments rendered from different templates or writer options can't be reused
+            if self._stored_signature(self.previous) != signature:
+                self.previous.close()
+                self.previous = None
+
+        self.temporary_path = path + ".tmp"
+        if os.path.exists(self.temporary_path):
+            os.remove(self.temporary_path)
+
+        self.current = sqlite3.connect(self.temporary_path)
+        self.current.execute("PRAGMA journal_mode = OFF")
+        self.current.execute("PRAGMA synchronous = OFF")
+        self.current.execute("CREATE TABLE Meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.current.execute("CREATE TABLE Fragments (page_id TEXT PRIMARY KEY, digest TEXT NOT NULL, fragment TEXT NOT NULL)")
+        self.current.execute("INSERT INTO Meta VALUES ('signature', ?)", (signature,))
+
+    @staticmethod
+    def _stored_signature(db: sqlite3.Connection) -> Optional[str]:
+        try:
+            row = db.execute("SELECT value FROM Meta WHERE key = 'signature'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+
+    def lookup(self, page_id: str, digest: str) -> Optional[str]:
+        row = None
+        if self.previous is not None:
+            row = self.previous.execute("SELECT digest, fragment FROM Fragments WHERE page_id = ?", (page_id,)).fetchone()
+
+        if row is not None and row[0] == digest:
+            self.hits += 1
+            return row[1]
+
+        self.misses += 1
+        return None
+
+    def store(self, page_id: str, digest: str, fragment: str):
+        self.current.execute("INSERT OR REPLACE INTO Fragments VALUES (?, ?, ?)", (page_id, digest, fragment))
+
+    def close(self):
+        if self.previous is not None:
+            self.previous.close()
+
+        self.current.commit()
+        self.current.close()
+        os.replace(self.temporary_path, self.path)
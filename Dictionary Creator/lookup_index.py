@@ -0,0 +1,239 @@
+'''
+A lookup store for querying the dictionary outside of Dictionary.app, built by dictionary_creator.py with --lookup
+alongside the XML. It's an SQLite database with the schema:
+
+CREATE TABLE Pages (
+    id INTEGER PRIMARY KEY,
+    page_id TEXT NOT NULL,  -- The id of the page in the dictionary XML
+    language TEXT NOT NULL, -- yue for Cantonese entries, en for English entries
+    title TEXT NOT NULL,    -- Traditional characters or the English word
+    content TEXT NOT NULL   -- The page as JSON
+)
+
+CREATE TABLE Keys (
+    key TEXT NOT NULL,      -- Normalised search key (lower case, single spaced)
+    kind TEXT NOT NULL,     -- One of KEY_KINDS
+    page INTEGER NOT NULL REFERENCES Pages
+)
+
+Keys are indexed, so exact and prefix lookups are a single index range scan. Usage:
+
+python3 lookup_index.py lookup.db 你好
+python3 lookup_index.py lookup.db nei --prefix --kind toneless
+'''
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from datatypes import *
+
+import argparse
+import sqlite3
+import json
+import time
+import sys
+import os
+import re
+
+# Modules shared with the converters live in the Shared directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+
+from bulk_loader import BulkLoader
+
+
+KEY_KINDS = ["traditional", "simplified", "jyutping", "toneless", "english"]
+
+# Greater than any other character, so prefix + PREFIX_END is an upper bound for every key starting with prefix
+PREFIX_END = "\U0010FFFF"
+
+TONE_PATTERN = re.compile(r"[1-6]")
+
+
+def normalise(key: str) -> str:
+    return " ".join(key.lower().split())
+
+
+def remove_tones(reading: str) -> str:
+    return TONE_PATTERN.sub("", normalise(reading))
+
+
+def query_key(key: str, kind: Optional[str]) -> str:
+    # Queries are normalised the same way as the keys they're matched against
+    return remove_tones(key) if kind == "toneless" else normalise(key)
+
+
+def page_keys(page: Entry) -> List[Tuple[str, str]]:
+    '''
+    Every (key, kind) the page can be found by
+    '''
+    if isinstance(page, CantoneseEntry):
+        # Headwords such as 卡拉OK have Latin letters in them, which are lower cased like any query
+        keys = {(normalise(page.traditional), "traditional"), (normalise(page.simplified), "simplified")}
+        for reading in page.readings:
+            keys.add((normalise(reading), "jyutping"))
+            keys.add((remove_tones(reading), "toneless"))
+        return sorted(keys)
+    return [(normalise(page.page_title), "english")]
+
+
+def page_content(page: Entry) -> dict:
+    if isinstance(page, CantoneseEntry):
+        return {
+            "traditional": page.traditional,
+            "simplified": page.simplified,
+            "readings": page.readings,
+            "definitions": page.definitions,
+            "references": [
+                {"type": reference.type, "page_id": reference.page_id, "label": reference.label}
+                for reference in page.references
+            ],
+        }
+    return {
+        "word": page.page_title,
+        "senses": [
+            {
+                "meaning": sense.meaning,
+                "translations": [
+                    {
+                        "translation": translation.translation,
+                        "transliteration": translation.transliteration,
+                        "alternate": translation.alternate_form,
+                        "literal": translation.literal_meaning,
+                        "qualifier": translation.qualifier,
+                        "link": translation.link,
+                    }
+                    for translation in sense.translations
+                ],
+            }
+            for sense in page.translations
+        ],
+    }
+
+
+def page_from_content(content: dict) -> Entry:
+    '''
+    Rebuild a page from a stored record (page_content() along with the page id and language), so it can be rendered
+    '''
+    if content["language"] == CantoneseEntry.language:
+        page = CantoneseEntry(int(content["page_id"].rsplit("_", 1)[1]), content["traditional"], content["simplified"])
+        for reading in content["readings"]:
+            page.add_reading(reading)
+        for definition in content["definitions"]:
+            page.add_definition(definition)
+        # Stores built before references were kept have none
+        for reference in content.get("references", []):
+            page.add_cross_reference(CrossReference(reference["type"], reference["page_id"], reference["label"]))
+        return page
+
+    page = EnglishEntry(content["word"])
+    for sense in content["senses"]:
+        for translation in sense["translations"]:
+            page.add_translation(sense["meaning"], translation["translation"], translation["alternate"], translation["literal"], translation["qualifier"], translation["transliteration"], translation.get("link"))
+    return page
+
+
+class LookupIndexWriter:
+    def __init__(self, path: str):
+        if os.path.exists(path):
+            os.remove(path)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+        CREATE TABLE Pages (
+            id INTEGER PRIMARY KEY,
+            page_id TEXT NOT NULL,
+            language TEXT NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL
+        )
+        """)
+        self.db.execute("""
+        CREATE TABLE Keys (
+            key TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            page INTEGER NOT NULL REFERENCES Pages
+        )
+        """)
+
+        self.loader = BulkLoader(self.db)
+        # Including the page makes the index covering, so matching keys never need a lookup into Keys itself
+        self.loader.create_index("Keys", "key", "kind", "page")
+        self.pages = 0
+
+    def add(self, page: Entry):
+        self.pages += 1
+        content = json.dumps(page_content(page), ensure_ascii=False)
+        self.loader.insert("Pages", (self.pages, page.page_id, page.language, page.page_title, content))
+        for key, kind in page_keys(page):
+            self.loader.insert("Keys", (key, kind, self.pages))
+
+    def index_pages(self, pages: Iterable[Entry]) -> Iterator[Entry]:
+        # Adds pages to the index as they pass through on their way to the dictionary writer
+        for page in pages:
+            self.add(page)
+            yield page
+
+    def close(self):
+        self.loader.close()
+        self.db.execute("ANALYZE")
+        self.db.commit()
+        self.db.close()
+
+
+class LookupIndex:
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _query(self, condition: str, parameters: list, kind: Optional[str], limit: int) -> List[Dict]:
+        if kind is not None:
+            condition += " AND kind = ?"
+            parameters.append(kind)
+        parameters.append(limit)
+
+        rows = self.db.execute(f"""
+        SELECT DISTINCT Pages.id, page_id, language, content
+        FROM Keys JOIN Pages ON Keys.page = Pages.id
+        WHERE {condition}
+        ORDER BY key, Pages.id
+        LIMIT ?
+        """, parameters)
+
+        return [
+            {"page_id": page_id, "language": language, **json.loads(content)}
+            for _, page_id, language, content in rows
+        ]
+
+    def exact(self, key: str, kind: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        return self._query("key = ?", [query_key(key, kind)], kind, limit)
+
+    def prefix(self, key: str, kind: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        key = query_key(key, kind)
+        return self._query("key >= ? AND key < ?", [key, key + PREFIX_END], kind, limit)
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index", type=str, help="lookup store built by dictionary_creator.py --lookup")
+    parser.add_argument("query", type=str)
+    parser.add_argument("--prefix", action="store_true", help="find keys starting with the query")
+    parser.add_argument("--kind", choices=KEY_KINDS, help="only match keys of this kind")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    index = LookupIndex(args.index)
+
+    start = time.perf_counter()
+    search = index.prefix if args.prefix else index.exact
+    results = search(args.query, args.kind, args.limit)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    print(f"{len(results)} results in {elapsed * 1000:.3f}ms", file=sys.stderr)
+
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+'''
+Turns the English definitions of the Cantonese entries around into English pages, so a word like "dog" also finds
+every entry with "dog" in its definitions, not just the ones Wiktionary lists as translations.
+
+Each definition is tokenised once, as the Cantonese pages go past on their way to the writer, into an inverted index
+from English term to entries. Terms are the words of a definition other than stopwords, with anything in brackets
+left out, and the whole definition too if it's only a few words long. Cross-references such as "CL:" and "see ..."
+aren't definitions and are skipped. For each term only the best MAX_ENTRIES entries are kept, ranked by:
+
+1. Whether the definition is exactly the term ("dog" before "hot dog")
+2. The position of the definition in the entry, the first definition is usually the main sense
+3. The number of words in the definition, shorter definitions are more specific
+'''
+
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from datatypes import *
+
+import heapq
+import re
+
+
+# Entries kept for each English term
+MAX_ENTRIES = 20
+
+# Longest definition, in words, that's also indexed as a term in its own right
+MAX_PHRASE_WORDS = 3
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "its", "of", "on",
+    "or", "sb", "sth", "so", "that", "the", "their", "this", "to", "was", "with",
+}
+
+# Definitions which refer to other entries rather than giving a meaning
+SKIPPED_PREFIXES = ("cl:", "m:", "see ", "see also", "also pr.", "taiwan pr.", "variant of", "old variant of", "abbr. for", "also written")
+
+PARENTHETICAL_PATTERN = re.compile(r"\([^()]*\)|\[[^\[\]]*\]")
+WORD_PATTERN = re.compile(r"[a-z][a-z'-]*")
+
+# Separates the readings of an entry with more than one
+READING_SEPARATOR = " / "
+
+# A single (negated) rank for a heap, so the worst match kept is at the top, followed by the match itself: the
+# definition as the entry gives it, the entry's traditional form, its page id and its transliteration
+Match = Tuple[int, int, int, int, str, str, str, Optional[str]]
+
+
+def definition_terms(definition: str) -> Tuple[Optional[str], List[str]]:
+    '''
+    The definition with anything in brackets removed, and the terms it should be found by
+    '''
+    text = PARENTHETICAL_PATTERN.sub(" ", definition.lower())
+    text = " ".join(text.split()).strip(" ,;.")
+    if not text or text.startswith(SKIPPED_PREFIXES):
+        return None, []
+
+    words = WORD_PATTERN.findall(text)
+    terms = {word for word in words if word not in STOPWORDS and len(word) > 1}
+
+    # Short definitions can be looked up as a whole, without the leading "to" of verbs ("to run" becomes "run")
+    phrase = text[3:] if text.startswith("to ") else text
+    if " " in phrase and len(phrase.split()) <= MAX_PHRASE_WORDS:
+        terms.add(phrase)
+
+    return text, sorted(terms)
+
+
+def index_terms(definitions: Iterable[str]) -> Set[str]:
+    # Every term the definitions are found by, which are the titles of the English pages the index adds to or creates
+    return {term for definition in definitions for term in definition_terms(definition)[1]}
+
+
+class ReverseIndex:
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.matches: Dict[str, List[Match]] = {}
+
+    def add(self, page: CantoneseEntry):
+        transliteration = READING_SEPARATOR.join(page.readings) or None
+
+        for position, definition in enumerate(page.definitions):
+            text, terms = definition_terms(definition)
+            length = len(text.split()) if text else 0
+
+            for term in terms:
+                # Terms come from the normalised text, but the definition is shown as the entry gives it
+                match = (-(text != term and text != "to " + term), -position, -length, -page.id, definition, page.traditional, page.page_id, transliteration)
+                heap = self.matches.setdefault(term, [])
+                if len(heap) < self.max_entries:
+                    heapq.heappush(heap, match)
+                elif match > heap[0]:
+                    heapq.heapreplace(heap, match)
+
+    def index_pages(self, pages: Iterable[Entry]) -> Iterator[Entry]:
+        # Adds the definitions of the Cantonese pages to the index as they pass through on their way to the writer
+        for page in pages:
+            if isinstance(page, CantoneseEntry):
+                self.add(page)
+            yield page
+
+    def terms(self) -> Iterator[Tuple[str, List[Match]]]:
+        '''
+        Every term with its matches, best first, ordered by term the same way SQLite orders text
+        '''
+        # Python and SQLite both order text by code point
+        for term in sorted(self.matches):
+            yield term, sorted(self.matches[term], reverse=True)
+
+    def merge(self, english_pages: Iterable[EnglishEntry]) -> Iterator[EnglishEntry]:
+        '''
+        Add the entries found for each term to the English pages (which must be ordered by title), creating pages
+        for terms which don't have one. The index must be complete before the first page is asked for.
+        '''
+        terms = self.terms()
+        next_term = next(terms, None)
+
+        for page in english_pages:
+            while next_term is not None and next_term[0] < page.page_title:
+                yield self.create_page(*next_term)
+                next_term = next(terms, None)
+
+            if next_term is not None and next_term[0] == page.page_title:
+                self.add_matches(page, next_term[1])
+                next_term = next(terms, None)
+
+            yield page
+
+        while next_term is not None:
+            yield self.create_page(*next_term)
+            next_term = next(terms, None)
+
+    def create_page(self, term: str, matches: List[Match]) -> EnglishEntry:
+        page = EnglishEntry(term)
+        self.add_matches(page, matches)
+        return page
+
+    @staticmethod
+    def add_matches(page: EnglishEntry, matches: List[Match]):
+        # Each definition becomes a sense, with the entries defined by it as its translations. They link to the entry
+        # itself, rather than whichever entry has its characters, so homographs each link to their own page
+        for *_, definition, traditional, page_id, transliteration in matches:
+            page.add_translation(definition, traditional, None, None, None, transliteration, dictionary_link(page_id))
@@ -0,0 +1,86 @@
+'''
+Checks and joins the shards written by dictionary_creator.py --shards. Each shard is a complete dictionary document,
+so they can be checked at the same time, one per process, with the expat parser that comes with Python:
+
+python3 shard_tools.py check CantoneseDictionary.*.xml --jobs 8
+python3 shard_tools.py join CantoneseDictionary.*.xml -o CantoneseDictionary.xml
+
+Joining keeps the shards in the order given (the shell sorts the glob above, which is the order they were written in)
+and gives the same document as writing without shards.
+'''
+
+from typing import List, Optional
+
+import xml.parsers.expat
+import multiprocessing
+import argparse
+import sys
+
+from apple_dictionary_writer import DICTIONARY_HEADER, DICTIONARY_FOOTER
+
+
+# Bytes of a shard read at a time while checking it
+READ_SIZE = 1024 * 1024
+
+
+def check_shard(path: str) -> Optional[str]:
+    '''
+    Parse a shard, returning a description of the first error in it, or None if it is well-formed
+    '''
+    parser = xml.parsers.expat.ParserCreate()
+
+    try:
+        with open(path, "rb") as in_file:
+            while True:
+                block = in_file.read(READ_SIZE)
+                parser.Parse(block, not block)
+                if not block:
+                    return None
+    except xml.parsers.expat.ExpatError as error:
+        return f"{path}:{error.lineno}:{error.offset + 1}: {xml.parsers.expat.ErrorString(error.code)}"
+    except OSError as error:
+        # A missing or unreadable shard is reported like any other error, rather than stopping the other checks
+        return f"{path}: {error.strerror or error}"
+
+
+def check_shards(paths: List[str], jobs: int) -> List[str]:
+    with multiprocessing.Pool(jobs) as pool:
+        return [error for error in pool.map(check_shard, paths, chunksize=1) if error is not None]
+
+
+def join_shards(paths: List[str], output_location: str):
+    with open(output_location, "w", encoding="utf-8") as out_file:
+        out_file.write(DICTIONARY_HEADER)
+
+        for path in paths:
+            with open(path, encoding="utf-8") as in_file:
+                shard = in_file.read()
+            if not shard.startswith(DICTIONARY_HEADER) or not shard.endswith(DICTIONARY_FOOTER):
+                raise ValueError(f"{path} isn't a dictionary shard")
+            out_file.write(shard[len(DICTIONARY_HEADER):-len(DICTIONARY_FOOTER)])
+
+        out_file.write(DICTIONARY_FOOTER)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["check", "join"])
+    parser.add_argument("shards", type=str, nargs="+")
+    parser.add_argument("-o", type=str, help="where to write the joined dictionary")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="number of shards checked at once")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        errors = check_shards(args.shards, args.jobs)
+        for error in errors:
+            print(error, file=sys.stderr)
+        print(f"{len(args.shards) - len(errors)} of {len(args.shards)} shards are well-formed")
+        sys.exit(1 if errors else 0)
+
+    if args.o is None:
+        parser.error("join needs an output path, given with -o")
+    join_shards(args.shards, args.o)
+
+
+if __name__ == "__main__":
+    main()
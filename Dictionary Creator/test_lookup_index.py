@@ -0,0 +1,31 @@
+import tempfile
+import unittest
+import os
+
+from datatypes import CantoneseEntry
+from lookup_index import LookupIndex, LookupIndexWriter
+
+
+class LookupIndexTest(unittest.TestCase):
+    def test_mixed_case_headword(self):
+        # Latin letters in a headword are matched however the query cases them
+        page = CantoneseEntry(1, "卡拉OK", "卡拉OK")
+        page.add_reading("kaa1 laa1 ou1 kei1")
+        page.add_definition("karaoke")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "lookup.db")
+            writer = LookupIndexWriter(path)
+            writer.add(page)
+            writer.close()
+
+            index = LookupIndex(path)
+            for query in ["卡拉OK", "卡拉ok"]:
+                self.assertEqual([result["traditional"] for result in index.exact(query, "traditional")], ["卡拉OK"])
+                self.assertEqual([result["traditional"] for result in index.exact(query, "simplified")], ["卡拉OK"])
+            self.assertEqual([result["traditional"] for result in index.prefix("卡拉O")], ["卡拉OK"])
+            index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
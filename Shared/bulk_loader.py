@@ -0,0 +1,135 @@
+'''
+Loads rows into an SQLite database in bulk. Rows are buffered per table and inserted in batches with executemany,
+all within a single transaction, with the database tuned for a one-off build rather than for safe concurrent use.
+Indexes are only created once everything has been loaded, as building them in one go is much faster than keeping
+them up to date on every insert.
+
+With background=True the batches are handed to a writer thread through a bounded queue, so the inserts (which release
+the GIL while SQLite works) overlap with parsing, and a parser that gets ahead of the writer waits rather than piling
+up rows in memory. The connection must then be opened with check_same_thread=False, and not used for anything else
+until the loader is closed.
+'''
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import threading
+import sqlite3
+import queue
+
+from instrumentation import phase, count_rows
+
+
+# Number of rows buffered for a table before they're inserted
+BATCH_SIZE = 10000
+
+# Number of batches waiting for the writer thread before insert() blocks
+QUEUE_SIZE = 8
+
+# Settings used while building, there's no journal so a crash mid-build leaves the database unusable.
+# That's fine for a build, which is started over from scratch anyway.
+BUILD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",  # 256MiB, negative sizes are in KiB
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+class BulkLoader:
+    def __init__(self, db: sqlite3.Connection, batch_size: int = BATCH_SIZE, background: bool = False):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers: Dict[str, List[tuple]] = defaultdict(list)
+        # Number of rows inserted into each table so far, including rows still in the buffers
+        self.row_counts: Dict[str, int] = defaultdict(int)
+        self.indexes: List[Tuple[str, Tuple[str, ...]]] = []
+
+        for pragma in BUILD_PRAGMAS:
+            self.db.execute(pragma)
+
+        self.queue: Optional[queue.Queue] = None
+        self.error: Optional[BaseException] = None
+        if background:
+            self.queue = queue.Queue(QUEUE_SIZE)
+            self.writer = threading.Thread(target=self._write_batches, name="sqlite writer", daemon=True)
+            self.writer.start()
+
+    def insert(self, table: str, row: tuple):
+        buffer = self.buffers[table]
+        buffer.append(row)
+        self.row_counts[table] += 1
+
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table: str):
+        buffer = self.buffers[table]
+        if not buffer:
+            return
+
+        if self.queue is None:
+            self._execute(table, buffer)
+            buffer.clear()
+        else:
+            if self.error is not None:
+                raise self.error
+            # The writer thread takes the list, a new one is started for the next batch
+            self.queue.put((table, buffer))
+            self.buffers[table] = []
+
+    def _execute(self, table: str, rows: List[tuple]):
+        placeholders = ", ".join("?" * len(rows[0]))
+        with phase("sql load"):
+            self.db.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+
+    def _write_batches(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            # After an error the rest of the batches are dropped, so the parser never blocks on a full queue
+            if self.error is None:
+                try:
+                    self._execute(*batch)
+                except BaseException as error:
+                    self.error = error
+
+    def _finish_writes(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.queue = None
+        if self.error is not None:
+            raise self.error
+
+    def flush_all(self):
+        for table in self.buffers:
+            self.flush(table)
+
+    def create_index(self, table: str, *columns: str):
+        '''
+        Create an index on the given columns of a table once loading has finished
+        '''
+        self.indexes.append((table, columns))
+
+    def close(self):
+        self.flush_all()
+        self._finish_writes()
+
+        with phase("sql index"):
+            for table, columns in self.indexes:
+                name = "{}_{}".format(table, "_".join(columns))
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+            self.db.commit()
+
+        for table, count in self.row_counts.items():
+            count_rows(table, count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.close()
@@ -0,0 +1,199 @@
+'''
+Progress and timing reports shared by the converters and the dictionary creator, so the build log shows how fast
+each stage is going and which phase of it the time went on.
+
+A stage is wrapped in instrument_stage(), which prints a summary when it finishes: the wall and CPU time of each
+phase, the rows inserted into each table and the peak resident memory. Phases are timed with phase(), which can be
+entered any number of times, the time adds up. The CPU time of a phase only counts the thread it runs on, so phases
+running at the same time on different threads don't count the same time twice. Progress through large inputs is
+reported with Progress.
+'''
+
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, TypeVar
+
+import cProfile
+import resource
+import time
+import sys
+import os
+
+
+# Minimum number of seconds between progress reports
+REPORT_INTERVAL = 5.0
+
+
+def format_bytes(count: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if count < 1024:
+            return f"{count:.1f}{unit}"
+        count /= 1024
+    return f"{count:.1f}TiB"
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    # ru_maxrss is in bytes on macOS but in KiB on Linux
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Progress:
+    '''
+    Counts bytes, lines and pages as they are processed, printing the rate of each and the time left (if the total
+    is known) every few seconds. The total is in the unit given, bytes for input files or pages when writing.
+    '''
+    def __init__(self, label: str, total: Optional[int] = None, unit: str = "bytes"):
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self._updates = 0
+
+    def update(self, size: int = 0, lines: int = 0, pages: int = 0):
+        self.counts["bytes"] += size
+        self.counts["lines"] += lines
+        self.counts["pages"] += pages
+
+        # Only look at the clock every so often, this is called for every line of some inputs
+        self._updates += 1
+        if self._updates & 0x3FF == 0 or pages or size > 65536:
+            now = time.monotonic()
+            if now - self.last_report >= REPORT_INTERVAL:
+                self.last_report = now
+                self.report(now)
+
+    def report(self, now: Optional[float] = None):
+        elapsed = max((now or time.monotonic()) - self.start, 1e-9)
+        parts = [f"[{self.label}]"]
+
+        done = self.counts[self.unit]
+        if self.total:
+            parts.append(f"{min(done / self.total, 1):6.1%}")
+
+        if self.counts["bytes"]:
+            parts.append(f"{format_bytes(self.counts['bytes'])} at {format_bytes(self.counts['bytes'] / elapsed)}/s")
+        for name in ["lines", "pages"]:
+            if self.counts[name]:
+                parts.append(f"{self.counts[name]} {name} ({self.counts[name] / elapsed:.0f}/s)")
+
+        if self.total and done:
+            parts.append(f"ETA {format_duration((self.total - done) * elapsed / done)}")
+
+        print(" ".join(parts), file=sys.stderr, flush=True)
+
+    def finish(self):
+        self.report()
+
+
+class Instrumentation:
+    def __init__(self, stage: str = ""):
+        self.stage = stage
+        self.start_wall = time.perf_counter()
+        self.start_times = os.times()
+        # Wall and CPU seconds spent in each phase, in the order the phases were first entered
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.rows: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name: str):
+        # CPU time is that of the thread the phase runs on, phases on different threads (such as the bulk loader's
+        # writer thread) overlap in wall time, but their CPU time isn't counted twice
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            totals = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            totals["wall"] += time.perf_counter() - start_wall
+            totals["cpu"] += time.thread_time() - start_cpu
+
+    def count_rows(self, table: str, count: int):
+        self.rows[table] += count
+
+    def summary(self) -> str:
+        times = os.times()
+        wall = time.perf_counter() - self.start_wall
+        cpu = (times.user - self.start_times.user) + (times.system - self.start_times.system)
+        worker_cpu = (times.children_user - self.start_times.children_user) + (times.children_system - self.start_times.children_system)
+
+        prefix = f"[{self.stage}]"
+        lines = []
+        for name, totals in self.phases.items():
+            lines.append(f"{prefix} {name}: {totals['wall']:.2f}s wall, {totals['cpu']:.2f}s CPU")
+        for table, count in self.rows.items():
+            lines.append(f"{prefix} {table}: {count} rows inserted")
+
+        total = f"{prefix} total: {wall:.2f}s wall, {cpu:.2f}s CPU"
+        if worker_cpu:
+            total += f" (+{worker_cpu:.2f}s CPU in worker processes)"
+        total += f", peak RSS {format_bytes(peak_rss())}"
+        if worker_cpu:
+            total += f" (worker processes {format_bytes(peak_rss(resource.RUSAGE_CHILDREN))})"
+        lines.append(total)
+
+        return "\n".join(lines)
+
+
+# Phases and row counts are recorded against the stage currently running
+_current = Instrumentation()
+
+
+def phase(name: str):
+    return _current.phase(name)
+
+
+def count_rows(table: str, count: int):
+    _current.count_rows(table, count)
+
+
+T = TypeVar("T")
+
+# Marks the end of the items in timed(), as None could be an item
+_END = object()
+
+
+def timed(items: Iterable[T], name: str) -> Iterator[T]:
+    '''
+    Time the work done producing each item of a lazy iterable (such as rows read from a database) as a phase
+    '''
+    iterator = iter(items)
+    while True:
+        with phase(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+@contextmanager
+def instrument_stage(stage: str, profile_path: Optional[str] = None):
+    '''
+    Record the phases of a stage, printing a summary of them at the end. If a profile path is given the stage is
+    run under cProfile and the statistics are written there, for viewing with pstats or snakeviz.
+    '''
+    global _current
+    previous = _current
+    _current = Instrumentation(stage)
+
+    profiler = cProfile.Profile() if profile_path else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        yield _current
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+        print(_current.summary(), flush=True)
+        _current = previous
@@ -0,0 +1,212 @@
+'''
+Keeps what the converters parsed out of their sources, so the next build can skip parsing any source that hasn't
+changed. Parsed data is pickled into a cache directory, keyed by the hash of the source files' contents, the version
+of the parser that read them and anything else the result depends on. Bump a parser's version whenever its output
+changes, so older results are never used.
+
+Hashing a file is much quicker than parsing it, but a whole Wiktionary dump still takes a while, so the hash of each
+file is remembered along with its size and modification time and only worked out again if either changes. The least
+recently used results are removed once the cache grows past its size limit.
+
+Results too big to keep in memory, such as the rows of a whole Wiktionary dump, are written a batch of items at a time
+with a ResultWriter and read back the same way with load_items().
+'''
+
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional
+
+import hashlib
+import pickle
+import json
+import time
+import sys
+import os
+
+from instrumentation import phase
+
+
+# Kept at the root of the repository, so every stage shares it
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".source_cache")
+
+# Size the cache is trimmed back to after every store
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+# Bytes of a source hashed at a time
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Remembers the hash of each source by path, size and modification time
+HASH_INDEX_NAME = "hashes.json"
+
+RESULT_EXTENSION = ".pickle"
+
+# Items written by a ResultWriter in each pickle
+BATCH_SIZE = 10000
+
+
+class SourceCache:
+    def __init__(self, directory: str = CACHE_DIRECTORY, max_bytes: int = MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.hash_index_path = os.path.join(directory, HASH_INDEX_NAME)
+        try:
+            with open(self.hash_index_path) as index_file:
+                self.hash_index: Dict[str, list] = json.load(index_file)
+        except (OSError, ValueError):
+            self.hash_index = {}
+
+    def file_hash(self, path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        known = self.hash_index.get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as in_file:
+            for block in iter(lambda: in_file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+
+        self.hash_index[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        self._write_atomically(self.hash_index_path, json.dumps(self.hash_index, indent=1).encode("utf-8"))
+        return digest.hexdigest()
+
+    def result_path(self, name: str, paths: List[str], version: int, extra: str = "") -> str:
+        '''
+        Where the result of parsing the given sources is stored, whether or not it has been yet
+        '''
+        key = hashlib.blake2b(digest_size=16)
+        # Pickles made by one version of Python aren't guaranteed to suit another
+        for part in [name, str(version), extra, sys.version.split()[0], *map(self.file_hash, paths)]:
+            key.update(part.encode("utf-8") + b"\0")
+        return os.path.join(self.directory, f"{name}-{key.hexdigest()}{RESULT_EXTENSION}")
+
+    def load_or_parse(self, name: str, paths: List[str], version: int, parse: Callable[[], Any], extra: str = "") -> Any:
+        '''
+        Get the result of parse() for the given sources from the cache, or run it and store the result if there is
+        none. extra holds anything else the result depends on, besides the contents of the sources.
+        '''
+        path = self.result_path(name, paths, version, extra)
+        result = self.load(path)
+
+        if result is None:
+            result = parse()
+            self.store(path, result)
+        return result
+
+    def store(self, path: str, result: Any):
+        with phase("source cache"):
+            self._write_atomically(path, pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+            self.evict()
+
+    def load(self, path: str) -> Optional[Any]:
+        '''
+        The result stored at a path from result_path(), or None if there isn't one
+        '''
+        start = time.perf_counter()
+        try:
+            with phase("source cache"), open(path, "rb") as in_file:
+                result = pickle.load(in_file)
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            # A damaged or unreadable result is parsed again and replaced
+            print(f"Ignoring unreadable source cache entry {os.path.basename(path)}: {error}")
+            return None
+
+        # The modification time marks when a result was last used, for eviction
+        os.utime(path)
+        print(f"Source cache hit {os.path.basename(path)} loaded in {time.perf_counter() - start:.2f}s")
+        return result
+
+    def load_items(self, path: str) -> Optional[Iterator[Any]]:
+        '''
+        The items of a result stored at a path from result_path(), read a batch at a time, or None if there isn't one
+        '''
+        try:
+            in_file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+        os.utime(path)
+        print(f"Source cache hit {os.path.basename(path)}, reading it as it's used")
+        return self._read_items(path, in_file)
+
+    @staticmethod
+    def _read_items(path: str, in_file: BinaryIO) -> Iterator[Any]:
+        with in_file:
+            while True:
+                try:
+                    with phase("source cache"):
+                        batch = pickle.load(in_file)
+                except EOFError:
+                    return
+                except Exception:
+                    # Some of the items have already been used, so the result can't be parsed again in its place.
+                    # It's removed so the next build does.
+                    print(f"Removing unreadable source cache entry {os.path.basename(path)}")
+                    os.remove(path)
+                    raise
+                yield from batch
+
+    def evict(self):
+        '''
+        Remove the least recently used results until the cache fits within its size limit
+        '''
+        results = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(RESULT_EXTENSION):
+                stat = entry.stat()
+                results.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in results)
+        for _, size, path in sorted(results):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    @staticmethod
+    def _write_atomically(path: str, data: bytes):
+        # Written next to the final path and moved into place, so a result is never seen half written
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as out_file:
+            out_file.write(data)
+        os.replace(temporary_path, path)
+
+
+class ResultWriter:
+    '''
+    Stores a result in the cache a batch of items at a time, so it never has to be held in memory as a whole. The result
+    only takes its place in the cache once the writer is closed, if it's discarded (or the build fails) there is none.
+    '''
+    def __init__(self, cache: SourceCache, path: str, batch_size: int = BATCH_SIZE):
+        self.cache = cache
+        self.path = path
+        self.batch_size = batch_size
+        # Written next to the final path and moved into place, as _write_atomically() does
+        self.temporary_path = f"{path}.{os.getpid()}.tmp"
+        self.out_file = open(self.temporary_path, "wb")
+        self.batch: List[Any] = []
+
+    def add(self, item: Any):
+        self.batch.append(item)
+        if len(self.batch) >= self.batch_size:
+            self._write_batch()
+
+    def _write_batch(self):
+        if self.batch:
+            with phase("source cache"):
+                pickle.dump(self.batch, self.out_file, pickle.HIGHEST_PROTOCOL)
+            self.batch = []
+
+    def close(self):
+        self._write_batch()
+        self.out_file.close()
+        os.replace(self.temporary_path, self.path)
+        self.cache.evict()
+
+    def discard(self):
+        self.out_file.close()
+        os.remove(self.temporary_path)
@@ -0,0 +1,98 @@
+'''
+Cantonese readings of every word in the database, used to give Mandarin translations (which only come with Pinyin, if
+anything) a Jyutping transliteration.
+
+Words are indexed by both their traditional and simplified forms. A word can have several readings, they're ranked by
+the number of entries giving the word that reading, then by the order the sources list them in. Words which aren't in
+the database themselves are split into the longest words which are, from left to right, and read a part at a time.
+'''
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import hashlib
+import sqlite3
+
+
+# Separates the readings of a word with more than one
+READING_SEPARATOR = " / "
+
+
+class ReadingIndex:
+    def __init__(self):
+        # Every reading of a word with the number of entries giving it, in the order they were first seen
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.readings: Dict[str, List[str]] = {}
+        self.longest_word = 0
+        # Transliterations already worked out, the same words are translated on many pages
+        self.cache: Dict[str, Optional[str]] = {}
+
+    @classmethod
+    def from_readings(cls, readings: Iterable[Tuple[str, str, str]]) -> "ReadingIndex":
+        '''
+        Index (traditional, simplified, reading) rows, in the order the sources list them in
+        '''
+        index = cls()
+        for traditional, simplified, reading in readings:
+            index.add(traditional, reading)
+            if simplified != traditional:
+                index.add(simplified, reading)
+        index.rank()
+        return index
+
+    @classmethod
+    def from_database(cls, cursor: sqlite3.Cursor) -> "ReadingIndex":
+        # Readings are in the order the sources list them in by rowid
+        return cls.from_readings(cursor.execute("SELECT traditional, simplified, reading FROM Readings NATURAL JOIN Entries ORDER BY Readings.rowid"))
+
+    def add(self, word: str, reading: str):
+        counts = self.counts.setdefault(word, {})
+        counts[reading] = counts.get(reading, 0) + 1
+
+    def rank(self):
+        '''
+        Order the readings of each word, most common first, once they've all been added
+        '''
+        for word, counts in self.counts.items():
+            # sorted() is stable, so readings given by as many entries stay in the order they were first seen
+            self.readings[word] = sorted(counts, key=counts.get, reverse=True)
+            self.longest_word = max(self.longest_word, len(word))
+        self.counts.clear()
+        self.cache.clear()
+
+    def signature(self) -> str:
+        # Identifies the readings, as the transliterations given to translations depend on them
+        return hashlib.sha1(repr(self.readings).encode("utf-8")).hexdigest()
+
+    def segment(self, word: str) -> Optional[List[str]]:
+        '''
+        Split a word into the longest words in the index from left to right, or None if a character isn't in it
+        '''
+        parts = []
+        position = 0
+
+        while position < len(word):
+            for end in range(min(len(word), position + self.longest_word), position, -1):
+                if word[position:end] in self.readings:
+                    parts.append(word[position:end])
+                    position = end
+                    break
+            else:
+                return None
+
+        return parts
+
+    def transliterate(self, word: str) -> Optional[str]:
+        '''
+        Every reading of a word in the index, most common first, otherwise the most common reading of each part of it
+        '''
+        if word in self.cache:
+            return self.cache[word]
+
+        if word in self.readings:
+            transliteration = READING_SEPARATOR.join(self.readings[word])
+        else:
+            parts = self.segment(word)
+            transliteration = None if parts is None else " ".join(self.readings[part][0] for part in parts)
+
+        self.cache[word] = transliteration
+        return transliteration
@@ -15,16 +15,23 @@ CREATE TABLE EnglishTranslations (
     qualifier TEXT -- Any extra information
 )
 
-The progress bar only offers an approximation of the time taken, based on the size of the 2019/11/20 Wiktionary dump.
+Progress is reported every few seconds, with the time left estimated from the size of the dump (unless it's compressed
+and read by a single process, where the decompressed size isn't known up front).
 Dumps can be obtained from here https://dumps.wikimedia.org/enwiktionary/
 
 Note that wiktionary dumps are huge (>6gb of pure text) and will probably break any text editor that tries to open them.
 '''
 
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict, Tuple, Iterator, BinaryIO
 from collections import defaultdict
 from dataclasses import dataclass
 
+import multiprocessing
+import functools
+import argparse
+import mmap
+import gzip
+import bz2
 import sqlite3
 import html
 import sys
@@ -32,9 +39,39 @@ import os
 import re
 
 
+# Modules shared between the converters live in the Shared directory at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
+
+from bulk_loader import BulkLoader
+from instrumentation import Progress, instrument_stage, phase
+from source_cache import ResultWriter, SourceCache
+from reading_index import ReadingIndex
+
+
 # Define the input and output database name
 DATABASE_NAME = "database.db"
 
+# Bump whenever the parsed translations change, so translations cached by older versions aren't used
+PARSER_VERSION = 2
+
+# Number of byte ranges the dump is split into per worker process, more ranges than workers evens out the load
+RANGES_PER_JOB = 4
+
+# Size of the blocks read at a time from compressed dumps which can't be split up front
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# Translation templates, see https://en.wiktionary.org/wiki/Template:t
+TRANSLATION_TEMPLATES = {"t", "t+", "t-simple", "tt", "tt+"}
+
+# Languages translations are kept for, Mandarin translations are kept if they have a Cantonese reading
+LANGUAGES = {"yue", "cmn"}
+
+# Lua codeblocks (templates) in a line of wikitext
+TEMPLATE_PATTERN = re.compile(r"{{.*?}}")
+
+# The Cantonese readings used by the parser inside a worker process, set once by the pool initialiser
+_worker_readings = ReadingIndex()
+
 
 @dataclass
 class Translation:
@@ -55,6 +92,10 @@ class TranslationGroup:
     translations: List[Translation]
 
 
+# A row of the EnglishTranslations table
+Row = Tuple[str, str, str, Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
 def generate_arguments(arguments: List[str]) -> (List[str], Dict[str, str]):
     '''
     Parse arguments from the Wiktionary translation template format
@@ -85,7 +126,7 @@ def decode_term(arguments: List[str]) -> Translation:
     '''
     type = arguments[0]
 
-    if type not in ["t", "t+", "t-simple", "tt", "tt+"]:
+    if type not in TRANSLATION_TEMPLATES:
         raise TypeError("Incorrect list type")
 
     positional, keyword = generate_arguments(arguments[1:])
@@ -123,46 +164,68 @@ def decode_term(arguments: List[str]) -> Translation:
     return result
 
 
-# Check for correct argument count
-if len(sys.argv) < 2:
-    print(f"USAGE: python3 {sys.argv[0]} INPUT_FILE.xml")
-    sys.exit(1)
-
-
-db = sqlite3.connect(DATABASE_NAME)
-cursor = db.cursor()
-
-readings_query = cursor.execute("SELECT traditional, simplified, reading FROM Readings NATURAL JOIN Entries")
-cantonese_readings = {}
-for traditional, simplified, reading in readings_query.fetchall():
-    if traditional in cantonese_readings and reading not in cantonese_readings[traditional]:
-        cantonese_readings[traditional].append(reading)
-    elif traditional not in cantonese_readings:
-        cantonese_readings[traditional] = [reading]
-
-    if simplified in cantonese_readings and reading not in cantonese_readings[simplified]:
-        cantonese_readings[simplified].append(reading)
-    elif simplified not in cantonese_readings:
-        cantonese_readings[simplified] = [reading]
-
-translations = defaultdict(list)
-
-with open(sys.argv[1]) as in_file:
-    page_title = None
-    recording = False
-    group = None
-
-    for line in in_file:
+class TranslationParser:
+    '''
+    Reads the dump a line at a time, tracking which page and translation table each line belongs to. The rows of
+    each translation table are passed to output as soon as the table ends, or kept in rows if there's no output.
+    '''
+    def __init__(self, cantonese_readings: ReadingIndex, progress: Optional[Progress] = None, output: Optional[Callable[[Row], None]] = None):
+        self.cantonese_readings = cantonese_readings
+        self.progress = progress
+        self.rows: List[Row] = []
+        self.output = output or self.rows.append
+        self.page_title: Optional[str] = None
+        self.recording = False
+        self.group: Optional[TranslationGroup] = None
+
+        # Pages and lines read, and the ones skipped without parsing as they have no translation tables
+        self.statistics = {"pages": 0, "lines": 0, "skipped_pages": 0, "skipped_lines": 0}
+
+    def feed_buffer(self, buffer, start: int, end: int):
+        '''
+        Parse the pages between offsets start and end of a bytes-like buffer (bytes or mmap)
+        '''
+        position = start
+
+        while position < end:
+            page_start = buffer.find(b"<page>", position, end)
+            if page_start == -1:
+                break
+
+            page_end = buffer.find(b"</page>", page_start, end)
+            page_end = end if page_end == -1 else page_end + len(b"</page>")
+            position = page_end
+
+            page = buffer[page_start:page_end]
+            line_count = page.count(b"\n") + 1
+            self.statistics["pages"] += 1
+            self.statistics["lines"] += line_count
+            if self.progress:
+                self.progress.update(len(page), line_count, 1)
+
+            # Most pages have no translations at all, a single search is enough to skip over them
+            if page.find(b"{{trans-top") == -1:
+                self.statistics["skipped_pages"] += 1
+                self.statistics["skipped_lines"] += line_count
+                continue
+
+            for line in page.decode("utf-8").split("\n"):
+                self.feed(line)
+
+    def feed(self, line: str):
         if "<title>" in line:
             # Get the page title
-            page_title = line.strip()[7:-8]
+            self.page_title = line.strip()[7:-8]
             # Special handling for translation pages (common for pages with many translations)
-            if page_title.endswith("/translations"):
-                page_title = page_title[:-13]
+            if self.page_title.endswith("/translations"):
+                self.page_title = self.page_title[:-13]
+            # Each page starts without a translation table, whichever byte range (and so parser) it's read by
+            self.recording = False
+            self.group = None
 
         elif "{{trans-top" in line:
             # Begin parsing translations and get the meaning
-            recording = True
+            self.recording = True
             parameters = line.strip()[:-2].split("|")
             parameters = [html.unescape(x) for x in parameters]
             meaning = ""
@@ -170,11 +233,15 @@ with open(sys.argv[1]) as in_file:
                 meaning = parameters[2]
             elif len(parameters) > 1:
                 meaning = parameters[1]
-            group = TranslationGroup(meaning, [])
+            self.group = TranslationGroup(meaning, [])
 
         elif "{{trans-bottom}}" in line:
             # Finish parsing translations
-            recording = False
+            self.recording = False
+            group = self.group
+            if group is None:
+                # A table closed without being opened on this page, there's nothing to finish
+                return
             if group.translations:
                 # Check if there was a Cantonese translation recorded for the group
                 cantonese_translations = {x.translation for x in group.translations if x.language_code == "yue"}
@@ -182,22 +249,35 @@ with open(sys.argv[1]) as in_file:
                 # If there are no Cantonese translations append as is, otherwise filter out Mandarin translations before appending
                 if cantonese_translations:
                     group.translations = [x for x in group.translations if x.language_code == "yue"]
-            
-            translations[page_title].append(group)
-        
+
+            for translation in group.translations:
+                self.output((
+                    self.page_title,
+                    group.meaning,
+                    translation.translation,
+                    translation.transliteration,
+                    translation.alternate_form,
+                    translation.literal_translation,
+                    translation.qualifier
+                ))
+
         elif "{{trans-mid}}" in line:
             # Mid is useless to us, defines layout on Wiktionary
             pass
 
-        elif recording:
+        elif self.recording:
+            # Only lines with a Cantonese or Mandarin translation are worth looking at any closer
+            if "|yue|" not in line and "|cmn|" not in line:
+                return
+
             qualifier = None
-            
+
             # Find all the Lua codeblocks in the line, split them and remove the enclosing {{ }}
-            for codeblock in map(lambda x: x.group(0)[2:-2].split("|"), re.finditer(r"{{.*?}}", line)):
+            for codeblock in map(lambda x: x.group(0)[2:-2].split("|"), TEMPLATE_PATTERN.finditer(line)):
                 if codeblock[0] == "qualifier" and len(codeblock) > 1:
                     # Run a join just in case the qualifier included a "|" for some reason...
                     qualifier = "|".join(codeblock[1:])
-                else:
+                elif codeblock[0] in TRANSLATION_TEMPLATES and len(codeblock) > 1 and codeblock[1] in LANGUAGES:
                     try:
                         new_entry = decode_term(codeblock)
                     except TypeError as e:
@@ -205,39 +285,267 @@ with open(sys.argv[1]) as in_file:
                     new_entry.qualifier = qualifier
                     # Check if the new entry is Mandarin, and if so check it has a Cantonese reading
                     if new_entry.language_code == "cmn":
-                        if new_entry.translation in cantonese_readings:
-                            # TODO Handle entries with multiple readings
-                            new_entry.transliteration = cantonese_readings[new_entry.translation][0]
-                            group.translations.append(new_entry)
+                        transliteration = self.cantonese_readings.transliterate(new_entry.translation)
+                        if transliteration is not None:
+                            new_entry.transliteration = transliteration
+                            self.group.translations.append(new_entry)
                     elif new_entry.language_code == "yue":
-                        group.translations.append(new_entry)
+                        self.group.translations.append(new_entry)
 
-cursor.execute("""
-CREATE TABLE EnglishTranslations (
-    english TEXT NOT NULL, -- English Translation
-    meaning TEXT NOT NULL, -- Any further explanation of en translation i.e. "distant to speaker and listener"
-    translation TEXT NOT NULL, -- Chinese Word
-    transliteration TEXT, -- Cantonese (Jyutping) transliteration of the Chinese characters
-    alternate TEXT, -- Alternate forms of the word
-    literal TEXT, -- Literal meaning of the translation
-    qualifier TEXT -- Any extra information
-)
-""")
-
-for word, meaning_group in translations.items():
-    for group in meaning_group:
-        for translation in group.translations:
-            parameters = (
-                word,
-                group.meaning,
-                translation.translation,
-                translation.transliteration,
-                translation.alternate_form,
-                translation.literal_translation,
-                translation.qualifier
-            )
-            cursor.execute("INSERT INTO EnglishTranslations VALUES (?, ?, ?, ?, ?, ?, ?)", parameters)
-
-cursor.close()
-db.commit()
-db.close()
+
+def open_dump(path: str) -> BinaryIO:
+    '''
+    Open a dump for reading as bytes, decompressing .bz2 and .gz dumps on the fly
+    '''
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    elif path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def find_page_ranges(path: str, count: int) -> List[Tuple[int, int]]:
+    '''
+    Split an uncompressed dump into roughly equal byte ranges, each starting on a line opening a <page>
+    '''
+    size = os.path.getsize(path)
+    boundaries = [0]
+
+    with open(path, "rb") as in_file:
+        for part in range(1, count):
+            in_file.seek(size * part // count)
+            # Skip the rest of the (probably partial) line the seek landed in
+            in_file.readline()
+
+            while True:
+                position = in_file.tell()
+                line = in_file.readline()
+                if not line:
+                    position = size
+                    break
+                if b"<page>" in line:
+                    break
+
+            if boundaries[-1] < position < size:
+                boundaries.append(position)
+
+    boundaries.append(size)
+    return [*zip(boundaries[:-1], boundaries[1:])]
+
+
+def find_stream_ranges(path: str, index_path: str) -> List[Tuple[int, int]]:
+    '''
+    Get the byte range of every bz2 stream in a multistream dump from its index, which has lines of the form
+    offset:page_id:page_title, where offset is the start of the stream containing the page
+    '''
+    offsets = {0}
+
+    with open_dump(index_path) as index_file:
+        for line in index_file:
+            offsets.add(int(line[:line.index(b":")]))
+
+    boundaries = sorted(offsets)
+    boundaries.append(os.path.getsize(path))
+    return [*zip(boundaries[:-1], boundaries[1:])]
+
+
+def read_blocks(in_file: BinaryIO) -> Iterator[bytes]:
+    '''
+    Read a dump in large blocks, each ending on the end of a page
+    '''
+    remainder = b""
+
+    while True:
+        block = in_file.read(BLOCK_SIZE)
+        if not block:
+            yield remainder
+            return
+
+        block = remainder + block
+        cut = block.rfind(b"</page>")
+        if cut == -1:
+            remainder = block
+            continue
+
+        cut += len(b"</page>")
+        yield block[:cut]
+        remainder = block[cut:]
+
+
+def split_parts(ranges: List[Tuple[int, int]], count: int) -> List[List[Tuple[int, int]]]:
+    '''
+    Group consecutive byte ranges into at most count parts of roughly equal size
+    '''
+    total = sum(end - start for start, end in ranges)
+    parts = [[]]
+    part_size = 0
+
+    for start, end in ranges:
+        if part_size >= total / count and len(parts) < count:
+            parts.append([])
+            part_size = 0
+        parts[-1].append((start, end))
+        part_size += end - start
+
+    return parts
+
+
+def initialise_worker(cantonese_readings: ReadingIndex):
+    global _worker_readings
+    _worker_readings = cantonese_readings
+
+
+def extract_part(path: str, part: Optional[List[Tuple[int, int]]], progress: Optional[Progress] = None, output: Optional[Callable[[Row], None]] = None) -> Tuple[List[Row], Dict[str, int]]:
+    '''
+    Parse the translations from the pages in the given byte ranges of the dump (or all of it if None), returning
+    the rows unless they're passed to output as they're parsed.
+    The ranges of a .bz2 dump must each be a whole stream of a multistream dump.
+    '''
+    parser = TranslationParser(_worker_readings, progress, output)
+
+    if path.endswith(".bz2") or path.endswith(".gz"):
+        if part is None:
+            with open_dump(path) as in_file:
+                for block in read_blocks(in_file):
+                    parser.feed_buffer(block, 0, len(block))
+        else:
+            with open(path, "rb") as in_file:
+                for start, end in part:
+                    in_file.seek(start)
+                    # Streams only ever hold whole pages, so each one can be decompressed and parsed on its own
+                    block = bz2.decompress(in_file.read(end - start))
+                    parser.feed_buffer(block, 0, len(block))
+    else:
+        with open(path, "rb") as in_file, mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for start, end in part or [(0, len(buffer))]:
+                parser.feed_buffer(buffer, start, end)
+
+    return parser.rows, parser.statistics
+
+
+def extract_translations(path: str, cantonese_readings: ReadingIndex, output: Callable[[Row], None], jobs: int = 1, index_path: Optional[str] = None):
+    '''
+    Parse the translations from the dump, passing each row to output in the order they appear in the dump
+    '''
+    # The index gives the offsets of the bz2 streams in a multistream dump, it means nothing for any other dump
+    if index_path is not None and not path.endswith(".bz2"):
+        raise ValueError(f"A multistream index can only be used with a .bz2 dump, not {os.path.basename(path)}")
+
+    statistics = defaultdict(int)
+    parts = [None]
+
+    if jobs > 1:
+        if index_path is not None:
+            parts = split_parts(find_stream_ranges(path, index_path), jobs * RANGES_PER_JOB)
+        elif path.endswith(".bz2") or path.endswith(".gz"):
+            print("Compressed dumps can only be split between jobs with a multistream index, using a single process")
+        else:
+            parts = [[part] for part in find_page_ranges(path, jobs * RANGES_PER_JOB)]
+
+    compressed = path.endswith(".bz2") or path.endswith(".gz")
+    progress = Progress(os.path.basename(path), None if compressed and len(parts) == 1 else os.path.getsize(path))
+
+    if len(parts) > 1:
+        with multiprocessing.Pool(jobs, initialise_worker, (cantonese_readings,)) as pool:
+            # Parts are output as they finish, in the order of the ranges, while the workers go on to the next ones.
+            # Workers can't report their own progress, so it's updated as each part is finished.
+            for part, (rows, part_statistics) in zip(parts, pool.imap(functools.partial(extract_part, path), parts)):
+                for row in rows:
+                    output(row)
+                for name, value in part_statistics.items():
+                    statistics[name] += value
+                progress.update(sum(end - start for start, end in part), part_statistics["lines"], part_statistics["pages"])
+    else:
+        initialise_worker(cantonese_readings)
+        _, statistics = extract_part(path, parts[0], progress, output)
+
+    progress.finish()
+
+    print(f"Skipped {statistics['skipped_pages']} of {statistics['pages']} pages and {statistics['skipped_lines']} of {statistics['lines']} lines without translations")
+
+
+def create_translations_table(cursor: sqlite3.Cursor):
+    cursor.execute("""
+    CREATE TABLE EnglishTranslations (
+        english TEXT NOT NULL, -- English Translation
+        meaning TEXT NOT NULL, -- Any further explanation of en translation i.e. "distant to speaker and listener"
+        translation TEXT NOT NULL, -- Chinese Word
+        transliteration TEXT, -- Cantonese (Jyutping) transliteration of the Chinese characters
+        alternate TEXT, -- Alternate forms of the word
+        literal TEXT, -- Literal meaning of the translation
+        qualifier TEXT -- Any extra information
+    )
+    """)
+
+
+def load_translations(path: str, cantonese_readings: ReadingIndex, output: Callable[[Row], None], jobs: int = 1, index_path: Optional[str] = None, use_cache: bool = True):
+    '''
+    Pass each row parsed from the dump to output, taking them from the source cache if the dump and readings haven't
+    changed since they were last parsed
+    '''
+    if not use_cache:
+        extract_translations(path, cantonese_readings, output, jobs, index_path)
+        return
+
+    # The transliterations depend on the readings as well as the dump
+    cache = SourceCache()
+    cache_path = cache.result_path("extractor", [path], PARSER_VERSION, cantonese_readings.signature())
+    rows = cache.load_items(cache_path)
+
+    if rows is None:
+        # Rows are still output as they're parsed, and written to the cache in batches as they go rather than kept
+        writer = ResultWriter(cache, cache_path)
+        try:
+            extract_translations(path, cantonese_readings, lambda row: (writer.add(row), output(row)), jobs, index_path)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+    else:
+        for row in rows:
+            output(row)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=str, help="English Wiktionary pages-articles XML dump, optionally .bz2 or .gz compressed")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes used to parse the dump")
+    parser.add_argument("--index", type=str, help="index of a multistream .bz2 dump, lets it be split between jobs")
+    parser.add_argument("--profile", type=str, help="write cProfile statistics for the run to this path")
+    parser.add_argument("--no-cache", action="store_true", help="parse the dump even if it hasn't changed since the last run")
+    args = parser.parse_args()
+
+    if args.index is not None and not args.input.endswith(".bz2"):
+        parser.error("--index can only be used with a multistream .bz2 dump")
+
+    return args
+
+
+def main():
+    args = get_arguments()
+
+    with instrument_stage("extractor", args.profile):
+        # The bulk loader writes from its own thread
+        db = sqlite3.connect(DATABASE_NAME, check_same_thread=False)
+        cursor = db.cursor()
+
+        with phase("load readings"):
+            cantonese_readings = ReadingIndex.from_database(cursor)
+
+        create_translations_table(cursor)
+
+        # Translations are written as they're parsed, in batches on a separate thread, rather than all at the end
+        loader = BulkLoader(db, background=True)
+        # Lets the dictionary creator read the translations grouped by English word without sorting them
+        loader.create_index("EnglishTranslations", "english")
+
+        with phase("parse"):
+            load_translations(args.input, cantonese_readings, functools.partial(loader.insert, "EnglishTranslations"), args.jobs, args.index, not args.no_cache)
+
+        loader.close()
+        cursor.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,28 +6,22 @@ rm -rf build
 echo "1. Have you have installed the necessary packages in pip3?"
 echo "2. Have you placed all the input files in the necessary locations?"
 
-cd "Chinese Dictionary Converter"
-rm database.db
+echo "Converting CC-CEDICT, CC-Canto and Wiktionary to Apple Dictionary app XML. Hold tight (~3-5 minutes)..."
+# All three stages run in one process, handing their output to the next in memory. The output is written without
+# blank space (as xmllint --noblanks would leave it, reducing the final compiled size) in shards which are checked in
+# parallel and then joined
+JOBS="$(getconf _NPROCESSORS_ONLN)"
+python3 pipeline.py "Wiktionary Converter/enwiktionary-20191120-pages-articles.xml" -o "Dictionary Creator/CantoneseDictionary.xml" --jobs "$JOBS" --incremental --minify --shards "$JOBS" || exit 1
 
-echo "Converting CCEDICT and CC-Canto to database..."
-python3 cantonese_cedict_combiner.py
-echo "Done"
-
-# Move the database file into the Wiktionary converter
-cd ..
-mv "Chinese Dictionary Converter/database.db" "Wiktionary Converter/database.db"
-cd "Wiktionary Converter"
-
-echo "Converting Wiktionary pages. Hold tight (~3-5 minutes)..."
-python3 wiktionary_translation_extractor.py enwiktionary-20191120-pages-articles.xml
-echo "Done"
-
-cd ..
-mv "Wiktionary Converter/database.db" "Dictionary Creator/database.db"
 cd "Dictionary Creator"
-
-echo "Generating Apple Dictionary app XML..."
-python3 dictionary_creator.py database.db -o CantoneseDictionary.xml
+# With a single shard the dictionary is written to CantoneseDictionary.xml directly
+if [ "$JOBS" -gt 1 ]; then
+    python3 shard_tools.py check CantoneseDictionary.[0-9]*.xml || exit 1
+    python3 shard_tools.py join CantoneseDictionary.[0-9]*.xml -o CantoneseDictionary.xml
+    rm CantoneseDictionary.[0-9]*.xml
+else
+    python3 shard_tools.py check CantoneseDictionary.xml || exit 1
+fi
 echo "Done"
 
 cd ..
@@ -44,9 +38,5 @@ echo "Done"
 
 cd build
 
-# Compress the dictionary down, removing all spaces in the file (Reduces final compiled size)
-xmllint CantoneseDictionary.xml --noblanks > compressed.xml
-mv compressed.xml CantoneseDictionary.xml
-
 make
 make install
@@ -0,0 +1,174 @@
+'''
+Runs the whole pipeline, from the sources to the dictionary XML, in a single process. The combined entries and the
+translations are handed from one stage to the next in memory rather than written to a database, moved along to the
+next directory and read back:
+
+python3 pipeline.py "Wiktionary Converter/enwiktionary-20191120-pages-articles.xml" -o CantoneseDictionary.xml
+
+The output is the same as running cantonese_cedict_combiner.py, wiktionary_translation_extractor.py and
+dictionary_creator.py one after the other. Each stage is still instrumented and reported separately.
+
+A checkpoint database can be written with --checkpoint, holding the same tables the separate stages write, so a run
+can stop after a stage with --to-stage and a later run can pick up from there with --from-stage. For example, to try
+out changes to the templates without parsing the dump again:
+
+python3 pipeline.py dump.xml --checkpoint database.db --to-stage extractor
+python3 pipeline.py dump.xml --checkpoint database.db --from-stage creator -o CantoneseDictionary.xml
+'''
+
+from typing import Dict, List, Optional, Tuple
+
+import argparse
+import sqlite3
+import sys
+import os
+
+from operator import itemgetter
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Each stage is imported from its own directory, and they all share the modules in Shared
+for directory in ["Shared", "Chinese Dictionary Converter", "Wiktionary Converter", "Dictionary Creator"]:
+    sys.path.append(os.path.join(ROOT, directory))
+
+from bulk_loader import BulkLoader
+from instrumentation import instrument_stage, phase
+from reading_index import ReadingIndex
+from cantonese_cedict_combiner import EntryRow, index_forms, link_targets, load_sources, number_entries, write_database
+from wiktionary_translation_extractor import Row, create_translations_table, load_translations
+from dictionary_creator import (
+    add_output_arguments, cantonese_pages_from_rows, count_expected_pages, count_reverse_index_pages, create_cantonese_entries,
+    create_english_pages, english_pages_from_rows, read_entry_rows, read_link_targets, write_dictionary
+)
+
+
+STAGES = ["combiner", "extractor", "creator"]
+
+
+def run_combiner(sources: str, use_cache: bool, checkpoint: Optional[str]) -> Tuple[List[EntryRow], Dict[str, int]]:
+    # The entry each form links to is picked in the order the sources give the entries, as write_database() does
+    traditional_forms: Dict[str, int] = {}
+    simplified_forms: Dict[str, int] = {}
+
+    with instrument_stage("combiner"):
+        with phase("parse"):
+            entry_rows = list(index_forms(number_entries(load_sources(sources, use_cache)), traditional_forms, simplified_forms))
+
+        if checkpoint:
+            if os.path.exists(checkpoint):
+                os.remove(checkpoint)
+            # The bulk loader writes from its own thread
+            db = sqlite3.connect(checkpoint, check_same_thread=False)
+            write_database(entry_rows, db)
+            db.close()
+
+    return entry_rows, link_targets(traditional_forms, simplified_forms)
+
+
+def run_extractor(dump: str, entry_rows: List[EntryRow], jobs: int, index_path: Optional[str], use_cache: bool, checkpoint: Optional[str], from_checkpoint: bool) -> List[Row]:
+    translations: List[Row] = []
+
+    with instrument_stage("extractor"):
+        with phase("load readings"):
+            if from_checkpoint:
+                # The entries are read back in id order, the readings need to be in the order the sources list them in
+                db = sqlite3.connect(checkpoint)
+                readings = ReadingIndex.from_database(db.cursor())
+                db.close()
+            else:
+                # In the order the combiner wrote them, the same as the database gives them to the extractor
+                readings = ReadingIndex.from_readings(
+                    (traditional, simplified, reading)
+                    for _, traditional, simplified, _, entry_readings, _ in entry_rows
+                    for reading in entry_readings
+                )
+
+        with phase("parse"):
+            load_translations(dump, readings, translations.append, jobs, index_path, use_cache)
+
+        if checkpoint:
+            db = sqlite3.connect(checkpoint, check_same_thread=False)
+            db.execute("DROP TABLE IF EXISTS EnglishTranslations")
+            create_translations_table(db.cursor())
+            with BulkLoader(db, background=True) as loader:
+                loader.create_index("EnglishTranslations", "english")
+                for row in translations:
+                    loader.insert("EnglishTranslations", row)
+            db.close()
+
+    return translations
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=str, help="English Wiktionary pages-articles XML dump, optionally .bz2 or .gz compressed")
+    parser.add_argument("--sources", type=str, default=os.path.join(ROOT, "Chinese Dictionary Converter"), help="directory holding CC-CEDICT, its Cantonese readings and CC-Canto")
+    parser.add_argument("--index", type=str, help="index of a multistream .bz2 dump, lets it be split between jobs")
+    parser.add_argument("--no-cache", action="store_true", help="parse the sources even if they haven't changed since the last run")
+    parser.add_argument("--profile", type=str, help="write cProfile statistics for the whole run to this path")
+    parser.add_argument("--checkpoint", type=str, help="database the combined entries and translations are written to, or read from")
+    parser.add_argument("--from-stage", choices=STAGES, default=STAGES[0], help="stage to start from, earlier stages are read from the checkpoint")
+    parser.add_argument("--to-stage", choices=STAGES, default=STAGES[-1], help="stage to stop after, the checkpoint keeps what it made")
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    first, last = STAGES.index(args.from_stage), STAGES.index(args.to_stage)
+    if first > last:
+        parser.error("--from-stage must not come after --to-stage")
+    if (first > 0 or last < len(STAGES) - 1) and not args.checkpoint:
+        parser.error("starting or stopping part way through needs a --checkpoint database")
+    if args.index is not None and not args.input.endswith(".bz2"):
+        parser.error("--index can only be used with a multistream .bz2 dump")
+    if last == len(STAGES) - 1 and args.o is None:
+        parser.error("the creator needs an output path, given with -o")
+
+    return args
+
+
+def main():
+    args = get_arguments()
+    first, last = STAGES.index(args.from_stage), STAGES.index(args.to_stage)
+    use_cache = not args.no_cache
+    checkpoint = args.checkpoint
+
+    with instrument_stage("pipeline", args.profile):
+        if first == STAGES.index("creator"):
+            # Everything comes from the checkpoint, read one page at a time just as dictionary_creator.py does
+            with instrument_stage("creator"):
+                expected_pages = count_expected_pages(checkpoint, args.reverse_index)
+                write_dictionary(create_cantonese_entries(checkpoint), create_english_pages(checkpoint), expected_pages, args, read_link_targets(checkpoint))
+            return
+
+        if first == STAGES.index("combiner"):
+            entry_rows, link_targets = run_combiner(args.sources, use_cache, checkpoint)
+        else:
+            with instrument_stage("checkpoint"), phase("read entries"):
+                entry_rows = list(read_entry_rows(checkpoint))
+                link_targets = read_link_targets(checkpoint)
+
+        if last == STAGES.index("combiner"):
+            return
+
+        translations = run_extractor(args.input, entry_rows, args.jobs, args.index, use_cache, checkpoint, first > 0)
+
+        if last == STAGES.index("extractor"):
+            return
+
+        with instrument_stage("creator"):
+            # The same orders the creator reads them from the database in, the sort is stable so translations of a
+            # word stay in the order they were parsed in
+            entry_rows.sort(key=itemgetter(0))
+            translations.sort(key=itemgetter(0))
+            english_words = {row[0] for row in translations}
+            expected_pages = len(entry_rows) + len(english_words)
+            if args.reverse_index:
+                expected_pages += count_reverse_index_pages(
+                    (definition for _, _, _, definitions, readings, _ in entry_rows if readings for definition in definitions),
+                    english_words
+                )
+            write_dictionary(cantonese_pages_from_rows(entry_rows), english_pages_from_rows(translations), expected_pages, args, link_targets)
+
+
+if __name__ == "__main__":
+    main()